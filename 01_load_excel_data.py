@@ -1,23 +1,20 @@
-import pandas as pd
-import os
+import argparse
+from saa_common import excel_file, data_store_file, load_merge_data
 
-# Define the path to the data folder and Excel file
-current_dir = os.path.dirname(os.path.abspath(__file__))
-data_folder = os.path.join(current_dir, 'data')
-excel_file = os.path.join(data_folder, 'SAA-DBL-MergeData.xlsx')
-# Output location for processed data
-output_file = os.path.join(current_dir, 'temp', 'processed_data.pkl')
-
-def load_excel_data():
+def load_excel_data(refresh=False):
     """
-    Load data from the Excel file into a pandas DataFrame
+    Load data from the Excel file into a pandas DataFrame.
+    The workbook is only parsed when it changed since the last run; otherwise
+    the rows come from the cached data store.
     """
     try:
-        # Read the Excel file
-        df = pd.read_excel(excel_file)
+        df, from_cache = load_merge_data(excel_file, refresh=refresh)
         
         # Display basic information about the DataFrame
-        print(f"Successfully loaded data from {excel_file}")
+        if from_cache:
+            print(f"Workbook unchanged, loaded cached data from {data_store_file}")
+        else:
+            print(f"Successfully loaded data from {excel_file}")
         print(f"DataFrame shape: {df.shape}")
         print("DataFrame columns:")
         for col in df.columns:
@@ -29,17 +26,16 @@ def load_excel_data():
         return None
 
 if __name__ == "__main__":
-    # Make temp directory if it doesn't exist
-    os.makedirs(os.path.join(current_dir, 'temp'), exist_ok=True)
+    parser = argparse.ArgumentParser(description="Load the merge data workbook into the data store")
+    parser.add_argument("--refresh", action="store_true",
+                        help="Re-read the workbook even if it has not changed")
+    args = parser.parse_args()
     
     # Execute when the script is run directly
-    df = load_excel_data()
+    df = load_excel_data(refresh=args.refresh)
     
     if df is not None:
         # Display the first 5 rows of the DataFrame
         print("\nFirst 5 rows of data:")
         print(df.head())
-        
-        # Save the processed data to a pickle file
-        df.to_pickle(output_file)
-        print(f"Processed data saved to {output_file}")
\ No newline at end of file
+        print(f"Processed data saved to {data_store_file}")
@@ -1,25 +1,171 @@
 import os
+import sys
+import argparse
 import pandas as pd
 import re
-import shutil
+import json
+import numbers
+import hashlib
+from io import BytesIO
 import datetime
+import traceback
+import zipfile
+from collections import deque
 from docx import Document
-from docxcompose.composer import Composer  # Add this import
 import docx.shared
-import docxcompose.composer as composer
 from docx.oxml.ns import qn
 from docx.oxml import OxmlElement
+from docx.text.paragraph import Paragraph
+from docx.blkcntnr import BlockItemContainer
+from docx.oxml import parse_xml
+from docx.opc.oxml import serialize_part_xml
+from saa_common import excel_file, data_store_file, file_hash, load_json_file, save_json_file, load_merge_data, stream_workbook_rows
+from saa_common import LOG_LEVELS, log, log_enabled, set_log_level, process_pool
+from saa_common import PREPARED_OUTPUT, get_lang_code, output_filename, prepare_rows
+from saa_common import source_index_file, manifest_file, index_sources
+from source_cache import source_cache, load_source_document, set_source_cache_mb
+from footnote_merge import append_document
+from docx_package import replace_package_members
+from run_report import StageTimer, write_run_report, read_run_report, print_stage_summary
+from run_report import reset_peak_rss, peak_rss_mb
+from write_behind import WriteBehind, WRITE_QUEUE_DEPTH, atomic_write_bytes
+from bundle import DocumentBundle
+from preflight import run_preflight, preflight_passed, print_preflight
 
 # Define paths
 current_dir = os.path.dirname(os.path.abspath(__file__))
 data_folder = os.path.join(current_dir, 'data')
 template_file = os.path.join(data_folder, 'SAA-DBL-TranscriptionTemplate.docx')
-input_data_file = os.path.join(current_dir, 'temp', 'processed_data.pkl')
+report_file = os.path.join(current_dir, 'temp', 'build_report.jsonl')
+
+# Code whose changes invalidate every generated document
+CODE_FILES = [os.path.abspath(__file__), os.path.join(current_dir, 'saa_common.py'),
+              os.path.join(current_dir, 'footnote_merge.py')]
+
+# Estimated peak RSS of a worker building one document, used by --memory-budget
+# when the last run report has no reading for it: the worker process with the
+# template loaded, plus a multiple of the source's uncompressed package size
+MEMORY_BASE_MB = 100
+MEMORY_PER_SOURCE_MB = 8
+
+# Spreadsheet columns that feed into a generated document
+ROW_COLUMNS = [
+    'Digital ID', 'Filename', 'Language', 'Date', 'Sender', 'Sender Place',
+    'Receiver', 'Receiver Place', 'DBL - Doc number', 'Transcript range',
+    'Translate range', 'volume'
+]
+
+# Columns that only feed the citation, header and metadata fields; when nothing
+# else changed, existing documents can be re-stamped with them instead of rebuilt
+RESTAMP_COLUMNS = [
+    'Digital ID', 'Date', 'Sender', 'Sender Place', 'Receiver', 'Receiver Place',
+    'DBL - Doc number', 'Transcript range', 'Translate range', 'volume'
+]
+BASE_COLUMNS = [column for column in ROW_COLUMNS if column not in RESTAMP_COLUMNS]
+
+# Metadata fields filled from the spreadsheet (Language is handled separately)
+METADATA_FIELDS = [
+    {"tag": "Date", "column": "Date"},
+    {"tag": "Sender", "column": "Sender"},
+    {"tag": "Sender Place", "column": "Sender Place"},
+    {"tag": "Receiver", "column": "Receiver"},
+    {"tag": "Receiver Place", "column": "Receiver Place"}
+]
 
 # Define output directory for generated documents
 OUTPUT_DIR = os.path.join(current_dir, "generated_documents")
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
+# Updated footnote versions of the sources (step 3's input), and where step 3
+# leaves the documents merged with them
+updated_folder = os.path.join(data_folder, 'DBL-UpdatedFootnotes')
+UPDATED_DIR = os.path.join(current_dir, "generated_docs_updated")
+
+def resolve_source(row, content_type, prefer_updated=False):
+    """
+    Return (source path, output directory) for a document. With prefer_updated,
+    an updated footnote file of the same name takes precedence over the
+    original source, and the document goes to UPDATED_DIR, where step 3 would
+    have left it after merging that file in.
+    """
+    source_filename = str(row.get(content_type))
+    if prefer_updated:
+        updated_path = os.path.join(updated_folder, source_filename)
+        if os.path.exists(updated_path):
+            return updated_path, UPDATED_DIR
+    return os.path.join(data_folder, 'transcriptions-translations', source_filename), OUTPUT_DIR
+
+class ParagraphIndex:
+    """
+    Single-pass index of the body paragraphs of a document.
+    Each paragraph is keyed by its field tag, the text up to and including the
+    first colon ("Citation:", "Date:", "Translation:", ...), so template fields
+    can be found without rebuilding doc.paragraphs and rejoining run text for
+    every lookup. Edits that rebuild a field keep its tag, so the index stays
+    valid until content is appended to the document.
+    
+    For a document that already has content, stop_at names the tags (e.g.
+    "Transcription:") where indexing stops, so the copied text is not searched.
+    """
+    def __init__(self, doc, stop_at=()):
+        self.paragraphs = []
+        self.tags = {}
+        for p in doc.element.body.iterchildren(qn('w:p')):
+            para = Paragraph(p, doc._body)
+            text = para.text.strip()
+            tag = text[:text.index(':') + 1] if ':' in text else None
+            if tag in stop_at:
+                break
+            self.paragraphs.append((para, text))
+            if tag:
+                self.tags.setdefault(tag, []).append(para)
+
+    def find(self, tag):
+        """Return the first paragraph starting with tag, or None"""
+        matches = self.tags.get(tag)
+        return matches[0] if matches else None
+
+    def find_all(self, tag):
+        """Return every paragraph starting with tag"""
+        return list(self.tags.get(tag, []))
+
+    def containing(self, *snippets):
+        """Return (paragraph, text) pairs whose text contains any of the snippets"""
+        return [(para, text) for para, text in self.paragraphs
+                if any(snippet in text for snippet in snippets)]
+
+    def remove(self, paragraphs):
+        """Remove a batch of paragraphs from the document and from the index"""
+        removed = set(para._p for para in paragraphs)
+        for p in removed:
+            p.getparent().remove(p)
+        self.paragraphs = [(para, text) for para, text in self.paragraphs if para._p not in removed]
+        for tag in list(self.tags):
+            self.tags[tag] = [para for para in self.tags[tag] if para._p not in removed]
+            if not self.tags[tag]:
+                del self.tags[tag]
+        return len(removed)
+
+# Citation book details for each volume of the series
+BOOK_TITLE = "Documents of Brotherly Love: Dutch Mennonite Aid to Swiss Anabaptists"
+VOLUME_CITATIONS = {
+    'I': {
+        "volume_info": "Volume 1, 1635-1709",
+        "editors": "edited by David J. Rempel Smucker and John L. Ruth",
+        "publisher": "(Millersburg, OH: Ohio Amish Library, 2007)",
+    },
+    'II': {
+        "volume_info": "Volume II, 1710-1711",
+        "editors": "",
+        "publisher": "(Millersburg, OH: Ohio Amish Library, 2015)",
+    },
+}
+DEFAULT_CITATION = {
+    "volume_info": "",
+    "editors": "",
+    "publisher": "(Millersburg, OH: Ohio Amish Library)",
+}
+
 def format_citation_text(row, content_type):
     """
     Format citation components for use with formatted insertion
@@ -41,23 +187,8 @@ def format_citation_text(row, content_type):
         doc_type = "translation"
         page_range = translate_range
     
-    # Determine the book title and additional info based on volume
-    if volume == 'I':
-        book_title = "Documents of Brotherly Love: Dutch Mennonite Aid to Swiss Anabaptists"
-        volume_info = "Volume 1, 1635-1709"
-        editors = "edited by David J. Rempel Smucker and John L. Ruth"
-        publisher = "(Millersburg, OH: Ohio Amish Library, 2007)"
-    elif volume == 'II':
-        book_title = "Documents of Brotherly Love: Dutch Mennonite Aid to Swiss Anabaptists"
-        volume_info = "Volume II, 1710-1711"
-        editors = ""
-        publisher = "(Millersburg, OH: Ohio Amish Library, 2015)"
-    else:
-        # Default case
-        book_title = "Documents of Brotherly Love: Dutch Mennonite Aid to Swiss Anabaptists"
-        volume_info = ""
-        editors = ""
-        publisher = "(Millersburg, OH: Ohio Amish Library)"
+    # Look up the additional book info for the volume
+    volume_citation = VOLUME_CITATIONS.get(volume, DEFAULT_CITATION)
     
     # Return components separately
     return {
@@ -65,50 +196,61 @@ def format_citation_text(row, content_type):
         "doc_number": doc_number,
         "date": date_value,
         "doc_type": doc_type,
-        "book_title": book_title,
-        "volume_info": volume_info,
-        "editors": editors,
-        "publisher": publisher,
+        "book_title": BOOK_TITLE,
+        "volume_info": volume_citation["volume_info"],
+        "editors": volume_citation["editors"],
+        "publisher": volume_citation["publisher"],
         "page_range": page_range
     }
 
-def add_formatted_citation(doc, citation_components):
+def remove_runs(para):
+    """
+    Remove every run of a paragraph before it is rebuilt. Emptying them with
+    run.clear() would leave the <w:r> elements behind, and each restamp would
+    add another set.
+    """
+    for run in para.runs:
+        para._p.remove(run._r)
+
+def add_formatted_citation(doc, citation_components, index=None):
     """Add citation with proper formatting"""
-    for i, para in enumerate(doc.paragraphs):
-        if para.text.strip().startswith("Citation:"):
-            # Found the citation paragraph
-            print(f"Found Citation line: '{para.text}'")
-            
-            # Clear the paragraph
-            for run in para.runs:
-                run.clear()
-            
-            # Add the citation parts with appropriate formatting
-            # Part 1: "Citation: " label in bold
-            run1 = para.add_run("Citation: ")
-            run1.bold = True
-            
-            # Part 2: Author and beginning of citation
-            para.add_run(f"{citation_components['author']}, \"Document {citation_components['doc_number']}, ")
-            para.add_run(f"{citation_components['date']}, {citation_components['doc_type']},\" in ")
-            
-            # Part 3: Book title in italics
-            run_title = para.add_run(citation_components['book_title'])
-            run_title.italic = True
-            
-            # Part 4: Volume info and the rest
-            if citation_components['volume_info']:
-                para.add_run(f" {citation_components['volume_info']}")
-            
-            if citation_components['editors']:
-                para.add_run(f", {citation_components['editors']}")
-            
-            para.add_run(f" {citation_components['publisher']}, {citation_components['page_range']}.")
-            
-            print(f"Added formatted citation with italicized book title")
-            return True
+    if index is None:
+        index = ParagraphIndex(doc)
+    para = index.find("Citation:")
+    if para is not None:
+        # Found the citation paragraph (para.text joins every run, so only when logged)
+        if log_enabled('debug'):
+            log(f"Found Citation line: '{para.text}'", 'debug')
+        
+        # Clear the paragraph
+        remove_runs(para)
+        
+        # Add the citation parts with appropriate formatting
+        # Part 1: "Citation: " label in bold
+        run1 = para.add_run("Citation: ")
+        run1.bold = True
+        
+        # Part 2: Author and beginning of citation
+        para.add_run(f"{citation_components['author']}, \"Document {citation_components['doc_number']}, ")
+        para.add_run(f"{citation_components['date']}, {citation_components['doc_type']},\" in ")
+        
+        # Part 3: Book title in italics
+        run_title = para.add_run(citation_components['book_title'])
+        run_title.italic = True
+        
+        # Part 4: Volume info and the rest
+        if citation_components['volume_info']:
+            para.add_run(f" {citation_components['volume_info']}")
+        
+        if citation_components['editors']:
+            para.add_run(f", {citation_components['editors']}")
+        
+        para.add_run(f" {citation_components['publisher']}, {citation_components['page_range']}.")
+        
+        log(f"Added formatted citation with italicized book title", 'debug')
+        return True
     
-    print("Warning: Citation line not found in document")
+    log("Warning: Citation line not found in document", 'warning')
     return False
 
 def update_digital_id_in_header(header, new_digital_id):
@@ -116,39 +258,68 @@ def update_digital_id_in_header(header, new_digital_id):
     # First check header paragraphs
     for para in header.paragraphs:
         if "Digital ID:" in para.text:
-            print(f"Found Digital ID in header paragraph: '{para.text}'")
+            if log_enabled('debug'):
+                log(f"Found Digital ID in header paragraph: '{para.text}'", 'debug')
             # Clear the paragraph
-            for run in para.runs:
-                run.clear()
+            remove_runs(para)
             # Create new text with proper formatting
             run1 = para.add_run("Digital ID: ")
             run1.bold = True
             para.add_run(new_digital_id)
-            print(f"Updated paragraph text to: 'Digital ID: {new_digital_id}'")
+            log(f"Updated paragraph text to: 'Digital ID: {new_digital_id}'", 'debug')
             return True
     
     # If not found in paragraphs, check header tables
     for table in header.tables:
-        print(f"Examining header table with {len(table.rows)} rows")
+        log(f"Examining header table with {len(table.rows)} rows", 'debug')
         for row in table.rows:
             for cell in row.cells:
                 for para in cell.paragraphs:
                     if "Digital ID:" in para.text:
-                        print(f"Found Digital ID in table cell: '{para.text}'")
+                        if log_enabled('debug'):
+                            log(f"Found Digital ID in table cell: '{para.text}'", 'debug')
                         # Clear the paragraph
-                        for run in para.runs:
-                            run.clear()
+                        remove_runs(para)
                         # Create new text with proper formatting
                         run1 = para.add_run("Digital ID: ")
                         run1.bold = True
                         para.add_run(new_digital_id)
-                        print(f"Updated cell text to: 'Digital ID: {new_digital_id}'")
+                        log(f"Updated cell text to: 'Digital ID: {new_digital_id}'", 'debug')
                         return True
     
-    print("WARNING: Digital ID not found in header paragraphs or tables")
+    log("WARNING: Digital ID not found in header paragraphs or tables", 'warning')
     return False
 
-def add_metadata_fields(doc, row, content_type):
+# Header parts inside a .docx package
+HEADER_PART = re.compile(r'word/header\d+\.xml')
+
+def stamp_digital_id(path, new_digital_id):
+    """
+    Update the Digital ID in the headers of an existing document without loading
+    the whole document. Only the word/headerN.xml parts are parsed and edited
+    (with update_digital_id_in_header); every other zip member is copied as is,
+    without recompressing. Headers that already show the ID are left alone.
+    Returns True if the document was rewritten.
+    """
+    replacements = {}
+    with zipfile.ZipFile(path) as package:
+        for name in package.namelist():
+            if not HEADER_PART.fullmatch(name):
+                continue
+            header = parse_xml(package.read(name))
+            texts = [Paragraph(p, None).text.strip() for p in header.iter(qn('w:p'))]
+            if not any("Digital ID:" in text for text in texts):
+                continue
+            if f"Digital ID: {new_digital_id}".strip() in texts:
+                continue
+            if update_digital_id_in_header(BlockItemContainer(header, None), new_digital_id):
+                replacements[name] = serialize_part_xml(header)
+    if not replacements:
+        return False
+    replace_package_members(path, replacements)
+    return True
+
+def add_metadata_fields(doc, row, content_type, index=None):
     """
     Update metadata fields in the document:
     - Copyright: Leave as is in template
@@ -159,16 +330,10 @@ def add_metadata_fields(doc, row, content_type):
     - 6-11 characters: 2 tabs
     - 12+ characters: 1 tab
     """
-    print("Processing metadata fields...")
+    log("Processing metadata fields...", 'debug')
     
     # Define metadata fields to process (excluding Copyright)
-    metadata_fields = [
-        {"tag": "Date", "column": "Date"},
-        {"tag": "Sender", "column": "Sender"},
-        {"tag": "Sender Place", "column": "Sender Place"},
-        {"tag": "Receiver", "column": "Receiver"},
-        {"tag": "Receiver Place", "column": "Receiver Place"}
-    ]
+    metadata_fields = list(METADATA_FIELDS)
     
     # Handle Language field (might differ based on content type)
     if content_type == 'Translate':
@@ -178,197 +343,186 @@ def add_metadata_fields(doc, row, content_type):
     
     metadata_fields.append({"tag": "Language", "column": None, "value": language_value})
     
+    if index is None:
+        index = ParagraphIndex(doc)
+    
+    # Copyright is left as it is in the template
+    if log_enabled('debug'):
+        for para in index.find_all("Copyright:"):
+            log(f"Keeping original Copyright text: '{para.text}'", 'debug')
+    
     # Find paragraphs that begin with each metadata tag
     paragraphs_to_delete = []
     
-    for i, para in enumerate(doc.paragraphs):
-        # Skip empty paragraphs
-        if not para.text.strip():
-            continue
+    for field in metadata_fields:
+        for para in index.find_all(f"{field['tag']}:"):
+            if log_enabled('debug'):
+                log(f"Found {field['tag']} field: '{para.text}'", 'debug')
             
-        # Skip Copyright paragraph - leave it as is
-        if para.text.strip().startswith("Copyright:"):
-            print(f"Keeping original Copyright text: '{para.text}'")
-            continue
-        
-        # Check for metadata fields
-        for field in metadata_fields:
-            if para.text.strip().startswith(f"{field['tag']}:"):
-                print(f"Found {field['tag']} field: '{para.text}'")
+            # Get the value from dataframe or from pre-defined value
+            if 'value' in field:
+                value = field['value']
+            else:
+                value = row.get(field['column'], '')
+            
+            # If the value is None, NaN, or empty string, mark paragraph for deletion
+            if pd.isna(value) or str(value).strip() == '':
+                log(f"  No value or NaN for {field['tag']}, will remove line", 'debug')
+                paragraphs_to_delete.append(para)
+            else:
+                # Clear the paragraph and rebuild it
+                remove_runs(para)
                 
-                # Get the value from dataframe or from pre-defined value
-                if 'value' in field:
-                    value = field['value']
-                else:
-                    value = row.get(field['column'], '')
+                # Add tag with bold formatting
+                bold_run = para.add_run(f"{field['tag']}: ")
+                bold_run.bold = True
                 
-                # If the value is None, NaN, or empty string, mark paragraph for deletion
-                if pd.isna(value) or str(value).strip() == '':
-                    print(f"  No value or NaN for {field['tag']}, will remove line")
-                    paragraphs_to_delete.append(i)
+                # Add tabs based on tag length
+                if len(field['tag']) <= 5:
+                    para.add_run("\t\t\t")  # 3 tabs for 5 or fewer chars
+                elif len(field['tag']) < 12:
+                    para.add_run("\t\t")     # 2 tabs for 6-11 chars
                 else:
-                    # Clear the paragraph and rebuild it
-                    for run in para.runs:
-                        run.clear()
-                    
-                    # Add tag with bold formatting
-                    bold_run = para.add_run(f"{field['tag']}: ")
-                    bold_run.bold = True
-                    
-                    # Add tabs based on tag length
-                    if len(field['tag']) <= 5:
-                        para.add_run("\t\t\t")  # 3 tabs for 5 or fewer chars
-                    elif len(field['tag']) < 12:
-                        para.add_run("\t\t")     # 2 tabs for 6-11 chars
-                    else:
-                        para.add_run("\t")       # 1 tab for 12+ chars
-                    
-                    # Add value
-                    para.add_run(str(value))
-                    print(f"  Updated with value: '{value}'")
+                    para.add_run("\t")       # 1 tab for 12+ chars
                 
-                break
+                # Add value
+                para.add_run(str(value))
+                log(f"  Updated with value: '{value}'", 'debug')
     
-    # Delete paragraphs marked for deletion (in reverse order to maintain indices)
-    for idx in sorted(paragraphs_to_delete, reverse=True):
-        p = doc.paragraphs[idx]._p
-        p.getparent().remove(p)
-        print(f"Removed paragraph at index {idx}")
+    # Delete the fields without a value in one batch
+    if paragraphs_to_delete:
+        removed = index.remove(paragraphs_to_delete)
+        log(f"Removed {removed} metadata paragraphs without a value", 'debug')
     
     return doc
 
-def remove_instruction_text(doc):
+def remove_instruction_text(doc, index=None):
     """
     Remove the specific instruction text from the document
     """
     instruction_text = "<For the following PRINT fields, if they aren't available for a document, remove them."
     
-    print("Searching for instruction text...")
+    log("Searching for instruction text...", 'debug')
+    if index is None:
+        index = ParagraphIndex(doc)
     
     # Find paragraphs containing any part of the instruction text (more robust)
     paragraphs_to_delete = []
-    for i, para in enumerate(doc.paragraphs):
-        # Check for the start of the instruction text to identify the paragraph
-        if instruction_text in para.text:
-            print(f"Found instruction text at paragraph {i}: '{para.text[:50]}...'")
-            paragraphs_to_delete.append(i)
-        # Also check for sections of text in case it's broken up
-        elif "<For the following PRINT fields" in para.text or "remove them. For example" in para.text:
-            print(f"Found partial instruction text at paragraph {i}: '{para.text[:50]}...'")
-            paragraphs_to_delete.append(i)
-    
-    # Delete paragraphs with instruction text (in reverse order to maintain indices)
+    for para, text in index.containing(instruction_text, "<For the following PRINT fields", "remove them. For example"):
+        log(f"Found instruction text: '{text[:50]}...'", 'debug')
+        paragraphs_to_delete.append(para)
+    
+    # Delete paragraphs with instruction text in one batch
     if paragraphs_to_delete:
-        for idx in sorted(paragraphs_to_delete, reverse=True):
-            p = doc.paragraphs[idx]._p
-            p.getparent().remove(p)
-            print(f"Removed instruction paragraph at index {idx}")
-        print(f"Removed {len(paragraphs_to_delete)} paragraphs containing instruction text")
+        removed = index.remove(paragraphs_to_delete)
+        log(f"Removed {removed} paragraphs containing instruction text", 'debug')
     else:
-        print("No instruction text found")
+        log("No instruction text found", 'debug')
     
     return doc
 
-def copy_content_from_source(doc, row, content_type, data_folder, output_filename):
+def remove_template_placeholders(doc, index=None):
     """
-    Copy content from source file while preserving footnotes using docxcompose
+    Remove the transcription placeholder text and the Document Type line
     """
-    print("\n==== CONTENT COPYING WITH FOOTNOTES ====")
-    print(f"Document being created: {output_filename}")
-    print(f"Content type: {content_type}")
+    if index is None:
+        index = ParagraphIndex(doc)
+    
+    # Check for placeholder text and the Document Type line
+    paragraphs_to_delete = [para for para, text in index.containing("<copy/paste transcription here>")]
+    paragraphs_to_delete += index.find_all("Document Type:")
+    
+    # Delete marked paragraphs in one batch
+    if paragraphs_to_delete:
+        removed = index.remove(paragraphs_to_delete)
+        log(f"Removed {removed} placeholder and Document Type paragraphs", 'debug')
+    
+    return doc
+
+# Pre-cleaned template packages, built once per process and keyed by template path
+_template_cache = {}
+
+def get_clean_template(path=None):
+    """
+    Return the template as a serialized package with the instruction text,
+    placeholder and Document Type lines already removed. The cleanup gives the
+    same result for every row, so it runs once and each document is loaded from
+    the cached bytes.
+    """
+    path = path or template_file
+    if path not in _template_cache:
+        doc = Document(path)
+        index = ParagraphIndex(doc)
+        doc = remove_instruction_text(doc, index)
+        doc = remove_template_placeholders(doc, index)
+        stream = BytesIO()
+        doc.save(stream)
+        _template_cache[path] = stream.getvalue()
+    return _template_cache[path]
+
+def copy_content_from_source(doc, row, content_type, data_folder, output_filename, index=None, source_path=None):
+    """
+    Copy content from source file while preserving footnotes using docxcompose.
+    source_path overrides the file in data_folder/transcriptions-translations.
+    """
+    log("\n==== CONTENT COPYING WITH FOOTNOTES ====", 'debug')
+    log(f"Document being created: {output_filename}", 'debug')
+    log(f"Content type: {content_type}", 'debug')
     
     # Determine which column to use based on content_type
     source_filename = row.get(content_type)
     
     # If no source filename provided, nothing to copy
     if pd.isna(source_filename) or not source_filename:
-        print(f"No {content_type} source file specified for this document")
+        log(f"No {content_type} source file specified for this document", 'debug')
         return doc
     
     # Build full path to source file
-    source_path = os.path.join(data_folder, 'transcriptions-translations', source_filename)
+    if source_path is None:
+        source_path = os.path.join(data_folder, 'transcriptions-translations', source_filename)
     
     # Check if source file exists
     if not os.path.exists(source_path):
-        print(f"WARNING: Source file not found: {source_path}")
+        log(f"WARNING: Source file not found: {source_path}", 'warning')
         return doc
     
-    print(f"Source document: {source_path}")
+    log(f"Source document: {source_path}", 'debug')
     
     try:
-        import tempfile
-        
-        # Create temporary files
-        with tempfile.NamedTemporaryFile(suffix='.docx', delete=False) as temp_file:
-            temp_path = temp_file.name
-        
-        # Save the current document state to temp file
-        doc.save(temp_path)
-        
-        # Create another temporary file for the composed result
-        with tempfile.NamedTemporaryFile(suffix='.docx', delete=False) as result_file:
-            result_path = result_file.name
-            
         # Remove the field we don't want
         target_field = "Translation:" if content_type == "Translate" else "Transcription:"
         other_field = "Transcription:" if content_type == "Translate" else "Translation:"
         
-        paragraphs_to_delete = []
-        for i, para in enumerate(doc.paragraphs):
-            if para.text.strip().startswith(other_field):
-                paragraphs_to_delete.append(i)
-                print(f"Removing {other_field} field")
+        if index is None:
+            index = ParagraphIndex(doc)
         
-        for idx in sorted(paragraphs_to_delete, reverse=True):
-            p = doc.paragraphs[idx]._p
-            p.getparent().remove(p)
+        paragraphs_to_delete = index.find_all(other_field)
+        if paragraphs_to_delete:
+            log(f"Removing {other_field} field", 'debug')
+            index.remove(paragraphs_to_delete)
         
         # Make sure the target field exists
-        field_found = False
-        for para in doc.paragraphs:
-            if para.text.strip().startswith(target_field):
-                field_found = True
-                break
-                
+        field_found = index.find(target_field) is not None
+        
         if not field_found:
-            print(f"Adding {target_field} field")
+            log(f"Adding {target_field} field", 'debug')
             field_para = doc.add_paragraph()
             bold_run = field_para.add_run(f"{target_field} ")
             bold_run.bold = True
         
-        # Save the modified document
-        doc.save(temp_path)
-        
-        # Load the source document with docxcompose
-        master = Document(temp_path)
-        composer = Composer(master)
-        
         # Load source document
-        source_doc = Document(source_path)
-        
-        # Append the content (this preserves footnotes)
-        composer.append(source_doc)
+        source_doc = load_source_document(source_path)
         
-        # Save the composed document
-        composer.save(result_path)
+        # Append the content onto the in-memory document (this preserves footnotes);
+        # the caller saves it once. An uncached source is ours to move from.
+        method = append_document(doc, source_doc, consume=not source_cache.enabled)
         
-        # Load the resulting document
-        result_doc = Document(result_path)
-        
-        # Clean up temporary files
-        try:
-            os.unlink(temp_path)
-            os.unlink(result_path)
-        except:
-            pass
-        
-        print(f"Successfully copied content with footnotes from {source_filename}")
-        return result_doc
+        log(f"Successfully copied content with footnotes from {source_filename} ({method})", 'debug')
+        return doc
         
     except Exception as e:
-        import traceback
-        print(f"Error copying content with footnotes: {str(e)}")
-        print(traceback.format_exc())
+        log(f"Error copying content with footnotes: {str(e)}", 'error')
+        log(traceback.format_exc(), 'error')
         
         # Add error message to document
         error_para = doc.add_paragraph()
@@ -376,141 +530,672 @@ def copy_content_from_source(doc, row, content_type, data_folder, output_filenam
         error_run.bold = True
         
         return doc
-def create_document(row, content_type):
-    """Create a new document based on the template and row data"""
+
+def get_output_filename(row, content_type):
+    """Build the sanitized output filename for a row and content type"""
+    # Records from prepare_rows carry the filename already
+    prepared = row.get(PREPARED_OUTPUT[content_type])
+    if prepared is not None:
+        return prepared
+    
+    # Translations always use EN, transcriptions map the language name to a code
+    language_code = get_lang_code(row.get('Language', ''), content_type)
+    return output_filename(str(row.get('Filename', '')), language_code, content_type)
+
+def create_document(row, content_type, timer=None, write=None, prefer_updated=False):
+    """
+    Create a new document based on the template and row data.
+    If a StageTimer is given, the time spent in each build stage is recorded on it.
+    If write is given, the document is serialized in memory and handed to
+    write(output_path, data) instead of being saved to disk here.
+    With prefer_updated, the updated footnote file is composed instead of the
+    original source where there is one (see resolve_source), so the final
+    document is built in one pass without step 3.
+    """
     # Skip if the specified column has no value
     if pd.isna(row[content_type]):
         return None
+    if timer is None:
+        timer = StageTimer()
     
-    # Get values for filename
-    filename_value = str(row.get('Filename', ''))
-    
-    # Determine language code for the filename
-    if content_type == 'Translate':
-        # Always use EN for translations
-        language_code = 'EN'
-    else:
-        # For transcriptions, map language names to codes
-        language_value = str(row.get('Language', ''))
-        
-        # Check for combined language cases
-        if language_value.lower() == 'german/dutch':
-            language_code = 'DE-NL'
-        elif language_value.lower() == 'french; german':
-            language_code = 'FR-DE'
-        elif language_value.lower() == 'german':
-            language_code = 'DE'
-        elif language_value.lower() == 'dutch':
-            language_code = 'NL'
-        elif language_value.lower() == 'french':
-            language_code = 'FR'
-        else:
-            # Keep original value for other languages
-            language_code = language_value
-    
-    # Create a filename using the specified format with appropriate language code
-    safe_filename = f"{filename_value}_{language_code}_{content_type.lower()}.docx"
-    # Clean up filename to be valid (remove illegal characters)
-    safe_filename = re.sub(r'[<>:"/\\|?*]', '', safe_filename)
-    # Replace spaces with underscores
-    safe_filename = safe_filename.replace(" ", "_")
+    safe_filename = get_output_filename(row, content_type)
+    source_path, output_dir = resolve_source(row, content_type, prefer_updated)
     
-    output_path = os.path.join(OUTPUT_DIR, safe_filename)
+    output_path = os.path.join(output_dir, safe_filename)
     
     # Digital ID and other values still needed for document content
     digital_id = str(row.get('Digital ID', 'unknown'))
     doc_number = str(row.get('DBL - Doc number', 'unknown'))
     date_value = str(row.get('Date', 'unknown'))
     
-    # Create a copy of the template
-    print(f"Creating document: {output_path}")
-    shutil.copy(template_file, output_path)
-    
-    # Open the document
-    doc = Document(output_path)
-    
-    # Remove instruction text from the document
-    doc = remove_instruction_text(doc)
-    
-    # NEW: Remove placeholder text and Document Type lines
-    paragraphs_to_delete = []
-    for i, para in enumerate(doc.paragraphs):
-        # Check for placeholder text
-        if "<copy/paste transcription here>" in para.text:
-            print(f"Found placeholder text to remove at paragraph {i}")
-            paragraphs_to_delete.append(i)
+    # Start from a fresh copy of the pre-cleaned template
+    log(f"Creating document: {output_path}", 'debug')
+    with timer.stage("template_load"):
+        doc = Document(BytesIO(get_clean_template()))
         
-        # Check for Document Type line
-        if para.text.strip().startswith("Document Type:"):
-            print(f"Found Document Type line to remove at paragraph {i}")
-            paragraphs_to_delete.append(i)
-    
-    # Delete marked paragraphs (in reverse order to maintain indices)
-    for idx in sorted(paragraphs_to_delete, reverse=True):
-        p = doc.paragraphs[idx]._p
-        p.getparent().remove(p)
-        print(f"Removed paragraph at index {idx}")
+        # Index the template fields once; every body edit below goes through it
+        index = ParagraphIndex(doc)
     
     # Process the header sections
-    for section_idx, section in enumerate(doc.sections):
-        header = section.header
-        update_digital_id_in_header(header, digital_id)
-    
-    # Generate the enhanced citation text
-    citation_components = format_citation_text(row, content_type)
+    with timer.stage("header"):
+        for section_idx, section in enumerate(doc.sections):
+            header = section.header
+            update_digital_id_in_header(header, digital_id)
     
-    # Add formatted citation to the document
-    add_formatted_citation(doc, citation_components)
+    with timer.stage("citation"):
+        # Generate the enhanced citation text
+        citation_components = format_citation_text(row, content_type)
+        
+        # Add formatted citation to the document
+        add_formatted_citation(doc, citation_components, index)
     
     # Process metadata fields
-    doc = add_metadata_fields(doc, row, content_type)
+    with timer.stage("metadata"):
+        doc = add_metadata_fields(doc, row, content_type, index)
     
     # Add source content based on content type - now with proper footnote handling
-    doc = copy_content_from_source(doc, row, content_type, data_folder, os.path.basename(output_path))
+    with timer.stage("compose"):
+        doc = copy_content_from_source(doc, row, content_type, data_folder, os.path.basename(output_path), index,
+                                       source_path)
     
     # Save the modified document
-    doc.save(output_path)
+    with timer.stage("save"):
+        if write is None:
+            doc.save(output_path)
+        else:
+            stream = BytesIO()
+            doc.save(stream)
+            write(output_path, stream.getvalue())
     
     return output_path
 
-def main():
-    # Check if the processed data file exists
-    if not os.path.exists(input_data_file):
-        print(f"Error: Processed data file not found: {input_data_file}")
-        print("Please run step 1 first (make run)")
-        return
+def iter_jobs(rows):
+    """
+    Yield (output_filename, (row index, row, content_type)) for each document the
+    rows call for, in the order the rows arrive. rows can be prepare_rows(df),
+    df.iterrows() or the streaming workbook reader.
+    """
+    for idx, row in rows:
+        for content_type in ('Transcript', 'Translate'):
+            if not pd.isna(row.get(content_type, pd.NA)):
+                yield get_output_filename(row, content_type), (idx, row, content_type)
+
+def job_group_key(job_group, columns=ROW_COLUMNS, prefer_updated=False):
+    """
+    Content hash of everything a job group's output depends on: the code
+    version, the template, each row's relevant columns and its source document
+    (the updated footnote file, if prefer_updated picks it).
+    With columns=BASE_COLUMNS it leaves out the columns a restamp can update.
+    """
+    digest = hashlib.sha256()
+    for path in CODE_FILES + [template_file]:
+        digest.update(file_hash(path).encode())
+    for idx, row, content_type in job_group:
+        row_values = [content_type] + [str(row.get(column, '')) for column in columns]
+        digest.update(json.dumps(row_values).encode())
+        source_path, _ = resolve_source(row, content_type, prefer_updated)
+        digest.update(os.path.relpath(source_path, data_folder).encode())
+        digest.update(file_hash(source_path).encode())
+    return digest.hexdigest()
+
+def row_metadata(row):
+    """The restampable column values of a row, as recorded in the build manifest"""
+    return {column: str(row.get(column, '')) for column in RESTAMP_COLUMNS}
+
+def manifest_entry(job_group, prefer_updated=False):
+    """
+    Build manifest entry for an output: the key of all its inputs, the key of
+    the inputs a restamp cannot update, and the metadata it was stamped with
+    (from the group's last row, which is the one that wins). Outputs built
+    from an updated footnote file are marked "updated".
+    """
+    idx, row, content_type = job_group[-1]
+    entry = {
+        "key": job_group_key(job_group, prefer_updated=prefer_updated),
+        "base_key": job_group_key(job_group, BASE_COLUMNS, prefer_updated),
+        "metadata": row_metadata(row),
+    }
+    if resolve_source(row, content_type, prefer_updated)[1] == UPDATED_DIR:
+        entry["updated"] = True
+    return entry
+
+def recorded_entry(manifest, output_filename):
+    """Return the manifest entry for an output, or {} if there is none (or an old-style one)"""
+    entry = manifest.get(output_filename)
+    return entry if isinstance(entry, dict) else {}
+
+def run_job(job, prefer_updated=False):
+    """
+    Build the document for one (row index, row, content_type) job and return
+    its result. The document is not written here: the result carries the
+    serialized document as "data", for the caller's writer.
+    Errors are captured rather than raised so one bad row cannot stop the build.
+    """
+    idx, row, content_type = job
+    result = {"row": idx, "content_type": content_type, "source": str(row.get(content_type)),
+              "source_path": resolve_source(row, content_type, prefer_updated)[0],
+              "path": None, "data": None, "error": None}
+    timer = StageTimer()
+    def keep(path, data):
+        result["data"] = data
+    reset_peak_rss()
+    try:
+        result["path"] = create_document(row, content_type, timer, write=keep, prefer_updated=prefer_updated)
+    except Exception as e:
+        print(f"Error creating {content_type} document for row {idx}: {e}")
+        result["error"] = traceback.format_exc()
+    result["stages"] = timer.stages
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+class MemoryBudget:
+    """
+    Admission control for --memory-budget: the estimated peak RSS of the
+    worker jobs in flight (running, or finished and not yet handed to the
+    writer) must fit in budget_mb. A job that alone exceeds the budget runs
+    on its own. A job's estimate is the peak recorded for its output in the
+    last run report, or else a guess from its source's uncompressed size.
+    """
+    def __init__(self, budget_mb, report_path=report_file):
+        self.budget_mb = budget_mb
+        self.held_mb = 0.0
+        self.peaks = {record["output"]: record["peak_rss_mb"] for record in read_run_report(report_path)
+                      if record.get("peak_rss_mb")}
+    
+    def estimate(self, output_filename, job, prefer_updated=False):
+        if output_filename in self.peaks:
+            return self.peaks[output_filename]
+        idx, row, content_type = job
+        source_path, _ = resolve_source(row, content_type, prefer_updated)
+        try:
+            with zipfile.ZipFile(source_path) as package:
+                source_mb = sum(info.file_size for info in package.infolist()) / (1024 * 1024)
+        except (OSError, zipfile.BadZipFile):
+            source_mb = 0
+        return MEMORY_BASE_MB + MEMORY_PER_SOURCE_MB * source_mb
+    
+    def fits(self, cost):
+        return self.held_mb + cost <= self.budget_mb
+
+def run_jobs(jobs, writer, workers=1, write_queue=WRITE_QUEUE_DEPTH, budget=None, prefer_updated=False):
+    """
+    Build (output_filename, job) pairs serially or in worker processes and hand
+    each serialized document to writer (a WriteBehind), which is closed at the
+    end. Documents are written in job order, so the last job for an output
+    wins. write_queue caps the number of documents waiting in the writer's
+    queue. With workers, up to workers + write_queue more are being built or
+    wait to be collected, so at most workers + 2 x write_queue documents are
+    held in memory; with a MemoryBudget, the jobs not yet collected must also
+    fit in it.
+    
+    Returns (results, output filenames with a failed build or write).
+    """
+    in_flight = deque()
+    results = []
+    failed_files = set()
+    
+    def collect(output_filename, result):
+        # Hand the serialized document to the writer, in submission order
+        if result["data"] is not None:
+            writer.submit(result["path"], result["data"])
+            result["data"] = None
+        if result["error"]:
+            failed_files.add(output_filename)
+        results.append(result)
+    
+    # Build serially or fan the jobs out to a process pool
+    executor = None
+    if workers != 1:
+        print(f"Building documents with {workers or os.cpu_count()} workers")
+        executor = process_pool(workers, __name__)
+        max_in_flight = (workers or os.cpu_count()) + write_queue
+    
+    def collect_oldest():
+        output_filename, pending, cost = in_flight.popleft()
+        collect(output_filename, pending.result())
+        if budget is not None:
+            budget.held_mb -= cost
     
-    # Load the processed data
     try:
-        df = pd.read_pickle(input_data_file)
-        print(f"Loaded data with {len(df)} rows from {input_data_file}")
+        for output_filename, job in jobs:
+            if executor is None:
+                collect(output_filename, run_job(job, prefer_updated))
+                continue
+            cost = 0
+            if budget is not None:
+                # Wait for earlier jobs until this one fits in the memory budget
+                cost = budget.estimate(output_filename, job, prefer_updated)
+                while in_flight and not budget.fits(cost):
+                    collect_oldest()
+                budget.held_mb += cost
+            in_flight.append((output_filename, executor.submit(run_job, job, prefer_updated), cost))
+            # Pass on finished documents, and wait for the oldest once too many are held
+            while in_flight and (in_flight[0][1].done() or len(in_flight) > max_in_flight):
+                collect_oldest()
+        
+        while in_flight:
+            collect_oldest()
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        write_errors = writer.close()
+    
+    # A document that could not be written counts as failed
+    for result in results:
+        if result["path"] in write_errors:
+            result["error"] = write_errors[result["path"]]
+            failed_files.add(os.path.basename(result["path"]))
+    return results, failed_files
+
+def build_documents(rows, workers=1, force=False, write_queue=WRITE_QUEUE_DEPTH, budget=None,
+                    prefer_updated=False):
+    """
+    Build the documents for rows as they arrive, skipping outputs whose inputs
+    match the manifest from the last build. Documents are written behind the
+    build by a writer thread (see run_jobs). With prefer_updated, documents
+    whose source has an updated footnote file are built from it, into
+    UPDATED_DIR (see resolve_source).
+    
+    Jobs that resolve to the same output filename form a group. Every job of a
+    group after a rebuilt one is rebuilt too, and the manifest records the key
+    of the whole group. Since a group's first job never matches that key on its
+    own, colliding filenames are rebuilt on every run.
+    
+    Returns (results, number of jobs skipped, writer).
+    """
+    manifest = load_json_file(manifest_file)
+    job_groups = {}
+    rebuilt = set()
+    skipped = 0
+    
+    def outdated_jobs():
+        nonlocal skipped
+        for output_filename, job in iter_jobs(rows):
+            group = job_groups.setdefault(output_filename, [])
+            group.append(job)
+            idx, row, content_type = job
+            output_dir = resolve_source(row, content_type, prefer_updated)[1]
+            if not (force
+                    or output_filename in rebuilt
+                    or recorded_entry(manifest, output_filename).get("key") != job_group_key(
+                        group, prefer_updated=prefer_updated)
+                    or not os.path.exists(os.path.join(output_dir, output_filename))):
+                skipped += 1
+                continue
+            rebuilt.add(output_filename)
+            yield output_filename, job
+    
+    writer = WriteBehind(write_queue)
+    results, failed_files = run_jobs(outdated_jobs(), writer, workers, write_queue, budget, prefer_updated)
+    
+    # Record the inputs of every output that built cleanly
+    for output_filename in rebuilt:
+        previous = recorded_entry(manifest, output_filename)
+        if output_filename in failed_files:
+            manifest.pop(output_filename, None)
+            continue
+        entry = manifest_entry(job_groups[output_filename], prefer_updated)
+        manifest[output_filename] = entry
+        # The document moved between OUTPUT_DIR and UPDATED_DIR (its updated
+        # footnote file appeared or went away): remove the copy left behind
+        if previous and previous.get("updated") != entry.get("updated"):
+            stale_path = os.path.join(UPDATED_DIR if previous.get("updated") else OUTPUT_DIR, output_filename)
+            if os.path.exists(stale_path):
+                os.remove(stale_path)
+                log(f"Removed {stale_path}, now built to {UPDATED_DIR if entry.get('updated') else OUTPUT_DIR}", 'debug')
+    
+    # Remove outputs whose rows no longer exist in the spreadsheet
+    for output_filename in sorted(set(manifest) - set(job_groups)):
+        output_dir = UPDATED_DIR if recorded_entry(manifest, output_filename).get("updated") else OUTPUT_DIR
+        orphan_path = os.path.join(output_dir, output_filename)
+        if os.path.exists(orphan_path):
+            os.remove(orphan_path)
+            print(f"Removed orphaned document: {output_filename}")
+        del manifest[output_filename]
+    save_json_file(manifest_file, manifest)
+    
+    # Record which source each output was built from, for step 3
+    save_json_file(source_index_file, index_sources({
+        output_filename: (group[-1][2], str(group[-1][1][group[-1][2]]))
+        for output_filename, group in job_groups.items()
+    }))
+    
+    return results, skipped, writer
+
+def last_jobs(rows):
+    """The jobs of iter_jobs(rows), keeping only the last (winning) job for each output filename"""
+    jobs = {}
+    for output_filename, job in iter_jobs(rows):
+        jobs.pop(output_filename, None)
+        jobs[output_filename] = job
+    return list(jobs.items())
+
+def build_bundle(rows, bundle_path, workers=1, write_queue=WRITE_QUEUE_DEPTH, budget=None,
+                 prefer_updated=False):
+    """
+    Build every document for rows straight into one zip or tar archive at
+    bundle_path, with a manifest, instead of writing individual files to
+    OUTPUT_DIR. Documents sharing an output filename are only built for the
+    row that wins. The build manifest and OUTPUT_DIR are left alone.
+    With prefer_updated the bundle holds the final documents (see resolve_source).
+    Returns (results, writer).
+    """
+    bundle = DocumentBundle(bundle_path)
+    writer = WriteBehind(write_queue, write=bundle.add)
+    try:
+        results, failed_files = run_jobs(last_jobs(rows), writer, workers, write_queue, budget, prefer_updated)
+    except BaseException:
+        bundle.abort()
+        raise
+    bundle.close(step="build", failed=sorted(failed_files))
+    return results, writer
+
+def stamp_digital_ids(rows):
+    """
+    Re-stamp the header Digital ID of every existing output from the spreadsheet
+    rows. Documents are found in OUTPUT_DIR or, if the build manifest marks them
+    "updated", in UPDATED_DIR. The manifest entry of a stamped document is
+    refreshed when the Digital ID was the only input that changed, so the next
+    build does not redo it.
+    """
+    manifest = load_json_file(manifest_file)
+    job_groups = {}
+    for output_filename, job in iter_jobs(rows):
+        job_groups.setdefault(output_filename, []).append(job)
+    
+    stamped = 0
+    unchanged = 0
+    missing = 0
+    for output_filename, group in job_groups.items():
+        entry = recorded_entry(manifest, output_filename)
+        prefer_updated = bool(entry.get("updated"))
+        output_path = os.path.join(UPDATED_DIR if prefer_updated else OUTPUT_DIR, output_filename)
+        if not os.path.exists(output_path):
+            missing += 1
+            continue
+        row = group[-1][1]
+        if stamp_digital_id(output_path, str(row.get('Digital ID', 'unknown'))):
+            log(f"Stamped Digital ID into {output_filename}", 'debug')
+            stamped += 1
+        else:
+            unchanged += 1
+        # The document is current if the Digital ID is all that changed since its build
+        metadata = row_metadata(row)
+        if (entry.get("base_key") == job_group_key(group, BASE_COLUMNS, prefer_updated)
+                and dict(entry.get("metadata", {}), **{'Digital ID': metadata['Digital ID']}) == metadata):
+            manifest[output_filename] = manifest_entry(group, prefer_updated)
+    save_json_file(manifest_file, manifest)
+    print(f"Stamped {stamped} documents, {unchanged} already up to date, {missing} not built yet")
+
+def restamp_document(output_path, row, content_type, prefer_updated=False):
+    """
+    Reapply the header Digital ID, citation and metadata fields of an existing
+    document in place, leaving the transcription or translation body alone.
+    Only word/document.xml and the header parts are written back. A field
+    whose line was removed at build time (no value then) cannot be restored
+    this way, so such documents are rebuilt instead, and written through a
+    temporary file and a rename like the build's writes.
+    Returns "restamped" or "rebuilt".
+    """
+    doc = Document(output_path)
+    index = ParagraphIndex(doc, stop_at=("Transcription:", "Translation:"))
+    
+    for field in METADATA_FIELDS:
+        value = row.get(field['column'], '')
+        if not (pd.isna(value) or str(value).strip() == '') and index.find(f"{field['tag']}:") is None:
+            log(f"{os.path.basename(output_path)} has no {field['tag']} line to fill, rebuilding", 'debug')
+            create_document(row, content_type, write=atomic_write_bytes, prefer_updated=prefer_updated)
+            return "rebuilt"
+    
+    headers = {}
+    for section in doc.sections:
+        if update_digital_id_in_header(section.header, str(row.get('Digital ID', 'unknown'))):
+            headers[section.header.part.partname] = section.header.part
+    add_formatted_citation(doc, format_citation_text(row, content_type), index)
+    add_metadata_fields(doc, row, content_type, index)
+    
+    replacements = {doc.part.partname.lstrip('/'): serialize_part_xml(doc.part.element)}
+    for partname, part in headers.items():
+        replacements[partname.lstrip('/')] = serialize_part_xml(part.element)
+    replace_package_members(output_path, replacements)
+    return "restamped"
+
+def run_restamp(output_filename, job, prefer_updated=False):
+    """Restamp one output; errors are captured like run_job does"""
+    idx, row, content_type = job
+    result = {"output": output_filename, "status": None, "error": None}
+    try:
+        output_dir = resolve_source(row, content_type, prefer_updated)[1]
+        result["status"] = restamp_document(os.path.join(output_dir, output_filename), row, content_type,
+                                            prefer_updated)
     except Exception as e:
-        print(f"Error loading processed data: {e}")
+        print(f"Error restamping {output_filename}: {e}")
+        result["error"] = traceback.format_exc()
+    return result
+
+def restamp_documents(rows, workers=1, prefer_updated=False):
+    """
+    Update the citation, metadata and header fields of existing documents whose
+    restampable columns changed since they were last built or restamped. Outputs
+    whose sources, template, code or other columns changed are left for a build.
+    prefer_updated must match the build that made the documents, so documents
+    built from updated footnote files are found in UPDATED_DIR.
+    Returns (results, number unchanged, filenames that need a build).
+    """
+    manifest = load_json_file(manifest_file)
+    job_groups = {}
+    for output_filename, job in iter_jobs(rows):
+        job_groups.setdefault(output_filename, []).append(job)
+    
+    tasks = []
+    unchanged = 0
+    needs_build = []
+    for output_filename, group in job_groups.items():
+        entry = recorded_entry(manifest, output_filename)
+        idx, row, content_type = group[-1]
+        output_dir = resolve_source(row, content_type, prefer_updated)[1]
+        if (not os.path.exists(os.path.join(output_dir, output_filename))
+                or entry.get("base_key") != job_group_key(group, BASE_COLUMNS, prefer_updated)):
+            needs_build.append(output_filename)
+        elif entry.get("metadata") == row_metadata(group[-1][1]):
+            unchanged += 1
+        else:
+            tasks.append((output_filename, group[-1]))
+    
+    if workers == 1 or len(tasks) < 2:
+        results = [run_restamp(output_filename, job, prefer_updated) for output_filename, job in tasks]
+    else:
+        print(f"Restamping documents with {workers or os.cpu_count()} workers")
+        with process_pool(workers, __name__) as executor:
+            results = list(executor.map(run_restamp, *zip(*tasks), [prefer_updated] * len(tasks)))
+    
+    for result in results:
+        if result["error"]:
+            manifest.pop(result["output"], None)
+        else:
+            manifest[result["output"]] = manifest_entry(job_groups[result["output"]], prefer_updated)
+    save_json_file(manifest_file, manifest)
+    return results, unchanged, needs_build
+
+def report_records(results):
+    """Turn build results into run report records, one per document built or attempted"""
+    records = []
+    for result in results:
+        source_path = result["source_path"]
+        records.append({
+            "output": os.path.basename(result["path"]) if result["path"] else None,
+            "row": int(result["row"]) if isinstance(result["row"], numbers.Integral) else str(result["row"]),
+            "content_type": result["content_type"],
+            "source": result["source"],
+            "source_bytes": os.path.getsize(source_path) if os.path.exists(source_path) else None,
+            "error": result["error"] is not None,
+            "stages": result["stages"],
+            "total_ms": sum(result["stages"].values()),
+            "peak_rss_mb": result["peak_rss_mb"],
+        })
+    return records
+
+def main(workers=1, force=False, stream=False, report=report_file, stamp_ids=False, restamp=False,
+         write_queue=WRITE_QUEUE_DEPTH, bundle=None, memory_budget=None, prefer_updated=False,
+         preflight=True, check_only=False, df=None):
+    """
+    Run step 2; returns 1 if the pre-flight checks stopped it.
+    df is the workbook rows when the caller has already loaded them.
+    """
+    if df is not None and not stream:
+        rows = prepare_rows(df)
+    elif stream and not check_only:
+        # Read the workbook row by row; documents start building on the first row
+        print(f"Streaming rows from {excel_file}")
+        rows = stream_workbook_rows()
+    else:
+        # Load the processed data (the workbook is only re-read if it changed since step 1)
+        try:
+            df, from_cache = load_merge_data()
+            print(f"Loaded data with {len(df)} rows from {data_store_file if from_cache else excel_file}")
+        except Exception as e:
+            print(f"Error loading processed data: {e}")
+            return
+        # Plain records with the output filenames computed for the whole sheet
+        rows = prepare_rows(df)
+    
+    if stamp_ids:
+        stamp_digital_ids(rows)
+        return
+    
+    if restamp:
+        results, unchanged, needs_build = restamp_documents(rows, workers=workers, prefer_updated=prefer_updated)
+        restamped = sum(result["status"] == "restamped" for result in results)
+        rebuilt = sum(result["status"] == "rebuilt" for result in results)
+        print(f"Restamped {restamped} documents, rebuilt {rebuilt}, {unchanged} unchanged")
+        if needs_build:
+            print(f"{len(needs_build)} documents need a full build (new, or their sources, "
+                  f"template, code or other columns changed)")
+        for result in results:
+            if result["error"]:
+                print(f"- {result['output']}")
+                print(result["error"])
         return
     
-    # Track created documents
+    # Check the sheet against the source folders before any document work
+    if check_only or preflight:
+        if stream and not check_only:
+            log("Pre-flight checks need the whole sheet and are skipped with --stream", 'warning')
+        else:
+            problems = run_preflight(df, os.path.join(data_folder, 'transcriptions-translations'),
+                                     updated_folder, prefer_updated)
+            print_preflight(problems)
+            if not preflight_passed(problems):
+                if not check_only:
+                    print("Stopping before any document is built (--skip-preflight builds anyway)")
+                return 1
+        if check_only:
+            return
+    
+    budget = None
+    if memory_budget:
+        # Memory-bounded mode: sources are parsed per document and moved into it
+        # rather than cached and copied, and jobs only start while they fit the budget
+        print(f"Memory budget: {memory_budget} MB for the document workers")
+        set_source_cache_mb(0)
+        budget = MemoryBudget(memory_budget, report or report_file)
+    
+    if prefer_updated:
+        # Fused build and merge: updated footnote files replace their sources before composing
+        print(f"Using updated footnote files from {updated_folder} where present")
+        os.makedirs(UPDATED_DIR, exist_ok=True)
+    
+    start = datetime.datetime.now()
+    if bundle:
+        results, writer = build_bundle(rows, bundle, workers=workers, write_queue=write_queue, budget=budget,
+                                       prefer_updated=prefer_updated)
+        skipped = 0
+    else:
+        results, skipped, writer = build_documents(rows, workers=workers, force=force, write_queue=write_queue,
+                                                   budget=budget, prefer_updated=prefer_updated)
+    elapsed = (datetime.datetime.now() - start).total_seconds()
+    
+    # Track created documents and failures (results keep the job order)
     transcript_docs = []
     translate_docs = []
-    
-    # Process each row in the dataframe
-    for idx, row in df.iterrows():
-        # Create transcript document if column has value
-        if 'Transcript' in df.columns and not pd.isna(row.get('Transcript', pd.NA)):
-            doc_path = create_document(row, 'Transcript')
-            if doc_path:
-                transcript_docs.append(doc_path)
-                print(f"Created Transcript document: {os.path.basename(doc_path)}")
-        
-        # Create translate document if column has value
-        if 'Translate' in df.columns and not pd.isna(row.get('Translate', pd.NA)):
-            doc_path = create_document(row, 'Translate')
-            if doc_path:
-                translate_docs.append(doc_path)
-                print(f"Created Translate document: {os.path.basename(doc_path)}")
+    failed_jobs = []
+    for result in results:
+        if result["error"]:
+            failed_jobs.append(result)
+        elif result["path"]:
+            if result["content_type"] == 'Transcript':
+                transcript_docs.append(result["path"])
+            else:
+                translate_docs.append(result["path"])
+            log(f"Created {result['content_type']} document: {os.path.basename(result['path'])}", 'debug')
     
     print(f"\nGenerated {len(transcript_docs)} Transcript documents")
     print(f"Generated {len(translate_docs)} Translate documents")
-    print(f"Documents saved to: {os.path.abspath(OUTPUT_DIR)}")
+    if prefer_updated:
+        from_updated = sum(os.path.dirname(path) == UPDATED_DIR for path in transcript_docs + translate_docs)
+        print(f"{from_updated} of them built from updated footnote files, saved to: {os.path.abspath(UPDATED_DIR)}")
+    if bundle:
+        print(f"Documents bundled into: {os.path.abspath(bundle)}")
+    else:
+        print(f"Skipped {skipped} unchanged documents")
+        print(f"Documents saved to: {os.path.abspath(OUTPUT_DIR)}")
+    log(f"Wrote {writer.written} documents ({writer.bytes_written / 1e6:.1f} MB) "
+        f"in {writer.write_seconds:.2f}s behind the build")
+    
+    # Per-stage timings of every document built in this run
+    if report and results:
+        summary = write_run_report(report, report_records(results), workers=workers,
+                                   skipped=skipped, elapsed_s=elapsed, write_queue=write_queue,
+                                   write_s=round(writer.write_seconds, 3), memory_budget_mb=memory_budget)
+        if log_enabled('info'):
+            print_stage_summary(summary)
+        print(f"Run report written to {report}")
+    
+    if failed_jobs:
+        print(f"\n{len(failed_jobs)} documents failed:")
+        for result in failed_jobs:
+            print(f"- row {result['row']} ({result['content_type']})")
+            print(result["error"])
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Build documents from the template and processed data")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of worker processes (1 = serial, 0 = one per CPU core)")
+    parser.add_argument("--force", action="store_true",
+                        help="Rebuild every document, even if its inputs have not changed")
+    parser.add_argument("--stream", action="store_true",
+                        help="Read the workbook row by row and start building on the first row")
+    parser.add_argument("--log-level", choices=list(LOG_LEVELS), default=None,
+                        help="Console verbosity; 'debug' prints every step of every document (default: info)")
+    parser.add_argument("--report", default=report_file,
+                        help="JSONL run report with per-stage timings (empty string to disable)")
+    parser.add_argument("--restamp", action="store_true",
+                        help="Only update the citation, metadata and header fields of existing documents "
+                             "whose spreadsheet metadata changed")
+    parser.add_argument("--stamp-ids", action="store_true",
+                        help="Only update the header Digital ID of existing documents, patching the header parts in place")
+    parser.add_argument("--write-queue", type=int, default=WRITE_QUEUE_DEPTH,
+                        help="Number of finished documents that may wait for the background writer "
+                             f"(default: {WRITE_QUEUE_DEPTH})")
+    parser.add_argument("--bundle", default=None,
+                        help="Build every document into this .zip or .tar archive (with a manifest) "
+                             "instead of writing individual files")
+    parser.add_argument("--memory-budget", type=int, default=None, metavar="MB",
+                        help="Memory-bounded mode: drop parsed sources after use and only run as many "
+                             "documents at once as fit in this many MB of worker memory")
+    parser.add_argument("--prefer-updated", action="store_true",
+                        help="Build from the DBL-UpdatedFootnotes version of a source where there is one, "
+                             "saving those documents to generated_docs_updated (build and merge in one pass); "
+                             "with --restamp, restamps the documents such a build made")
+    parser.add_argument("--check", action="store_true",
+                        help="Only run the pre-flight checks (missing sources, filename collisions, "
+                             "unmapped languages) and exit")
+    parser.add_argument("--skip-preflight", action="store_true",
+                        help="Build even if the pre-flight checks find problems")
+    args = parser.parse_args()
+    if args.log_level:
+        set_log_level(args.log_level)
+    sys.exit(main(workers=args.workers, force=args.force, stream=args.stream, report=args.report,
+                  stamp_ids=args.stamp_ids, restamp=args.restamp, write_queue=args.write_queue,
+                  bundle=args.bundle, memory_budget=args.memory_budget, prefer_updated=args.prefer_updated,
+                  preflight=not args.skip_preflight, check_only=args.check))
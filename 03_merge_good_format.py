@@ -1,158 +1,341 @@
 import os
-import pandas as pd
+import argparse
 import shutil
+import tempfile
+import traceback
+from io import BytesIO
+from collections import deque
 from datetime import datetime
 from docx import Document
-from docxcompose.composer import Composer
-
-def get_lang_code(language, content_type):
-    if content_type == 'translate':
-        return 'EN'
-    l = language.lower()
-    if l == 'german/dutch':
-        return 'DE-NL'
-    if l == 'french; german':
-        return 'FR-DE'
-    if l == 'german':
-        return 'DE'
-    if l == 'dutch':
-        return 'NL'
-    if l == 'french':
-        return 'FR'
-    return language
-
-def replace_section_with_footnotes(target_path, footnote_path, section_label):
-    # Save to a temp file, then use Composer to append footnote content
-    temp_path = target_path + ".tmp"
-    shutil.copy(target_path, temp_path)
-    target_doc = Document(temp_path)
-    composer = Composer(target_doc)
-    footnote_doc = Document(footnote_path)
+from docx.oxml.ns import qn
+from docx.text.paragraph import Paragraph
+from saa_common import file_hash, load_json_file, save_json_file, load_merge_data, prepare_rows
+from saa_common import source_index_file, manifest_file, index_records
+from saa_common import LOG_LEVELS, log, set_log_level, process_pool
+from source_cache import source_cache, load_source_document
+from footnote_merge import insert_document
+from bundle import DocumentBundle
+
+# Code whose changes invalidate every merged document
+CODE_FILES = [os.path.abspath(__file__),
+              os.path.join(os.path.dirname(os.path.abspath(__file__)), 'footnote_merge.py'),
+              os.path.join(os.path.dirname(os.path.abspath(__file__)), 'saa_common.py')]
+
+# Paths
+base_dir = os.path.dirname(os.path.abspath(__file__))
+footnotes_dir = os.path.join(base_dir, "data", "DBL-UpdatedFootnotes")
+generated_dir = os.path.join(base_dir, "generated_documents")
+output_dir = os.path.join(base_dir, "generated_docs_updated")
+# Each merged output and the hashes it was built from
+ledger_path = os.path.join(base_dir, "temp", "merge_ledger.json")
+
+def is_metadata_field(para):
+    """Metadata fields start with a bold run ending in ':' (e.g. "Date:")"""
+    return any(run.bold and run.text.strip().endswith(':') for run in para.runs)
+
+def replace_section_with_footnotes(target_path, footnote_path, section_label, output=None):
+    """
+    Replace the content under section_label (e.g. "Transcription:" or "Translation:")
+    with the body of the updated footnote file. The target is loaded once, the
+    footnote document is composed straight into the section and the result is
+    saved once, over target_path or to output (a path or file-like object).
+    """
+    target_doc = Document(target_path)
+    body = target_doc.element.body
 
     # Find the section label (e.g., "Transcription:" or "Translation:") in the target doc
-    section_idx = None
-    for i, para in enumerate(target_doc.paragraphs):
-        if para.text.strip().startswith(section_label):
-            section_idx = i
+    label = None
+    for p in body.iterchildren(qn('w:p')):
+        if Paragraph(p, target_doc._body).text.strip().startswith(section_label):
+            label = p
             break
-    if section_idx is None:
+    if label is None:
         print(f"Section label '{section_label}' not found in {target_path}")
-        os.remove(temp_path)
         return False
 
-    # Remove all paragraphs after the section label up to the next metadata field or end
-    # (Assume metadata fields are bold and end with ':')
-    i = section_idx + 1
-    while i < len(target_doc.paragraphs):
-        para = target_doc.paragraphs[i]
-        if any(run.bold and run.text.strip().endswith(':') for run in para.runs):
+    # Remove everything after the section label up to the next metadata field or end
+    # in one pass over its siblings
+    to_remove = []
+    for element in label.itersiblings():
+        if element.tag == qn('w:sectPr'):
             break
-        p = para._p
-        p.getparent().remove(p)
-        # Do not increment i, as the list shrinks
-
-    # Save the truncated document
-    target_doc.save(temp_path)
-
-    # Now append the footnote_doc content after the section label
-    # (Composer appends at the end, so we need to move the section label to the end, append, then move back)
-    # Instead, we will use Word's structure: copy the section label paragraph, clear after, append, then save
-    # This is a workaround for docx limitations
-
-    # Open again for appending
-    target_doc = Document(temp_path)
-    composer = Composer(target_doc)
-    composer.append(footnote_doc)
-    composer.save(temp_path)
-
-    # Now, move the appended content to just after the section label
-    # Reload and manipulate paragraphs
-    doc = Document(temp_path)
-    section_idx = None
-    for i, para in enumerate(doc.paragraphs):
-        if para.text.strip().startswith(section_label):
-            section_idx = i
+        if element.tag == qn('w:p') and is_metadata_field(Paragraph(element, target_doc._body)):
             break
-    if section_idx is None:
-        print(f"Section label '{section_label}' not found after append in {target_path}")
-        os.remove(temp_path)
-        return False
+        to_remove.append(element)
+    for element in to_remove:
+        body.remove(element)
 
-    # Find where the appended content starts (first non-empty after section_idx)
-    appended_start = section_idx + 1
-    while appended_start < len(doc.paragraphs) and not doc.paragraphs[appended_start].text.strip():
-        appended_start += 1
-
-    # Move appended paragraphs to just after section label
-    appended_paragraphs = []
-    i = appended_start
-    while i < len(doc.paragraphs):
-        appended_paragraphs.append(doc.paragraphs[i])
-        i += 1
-    # Remove them from the end
-    for para in appended_paragraphs:
-        p = para._p
-        p.getparent().remove(p)
-    # Insert them after section_idx
-    for para in reversed(appended_paragraphs):
-        doc._body._body.insert(section_idx + 1, para._p)
+    # Insert the footnote document directly after the section label, carrying its
+    # footnotes and styles across (docxcompose handles anything more involved).
+    # An uncached source is ours to move from.
+    insert_document(target_doc, body.index(label) + 1, load_source_document(footnote_path),
+                    consume=not source_cache.enabled)
 
     # Save the final document
-    doc.save(target_path)
-    os.remove(temp_path)
+    target_doc.save(target_path if output is None else output)
     return True
 
-def main():
-    # Paths
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    data_dir = os.path.join(base_dir, "data")
-    footnotes_dir = os.path.join(data_dir, "DBL-UpdatedFootnotes")
-    generated_dir = os.path.join(base_dir, "generated_documents")
-    excel_path = os.path.join(data_dir, "SAA-DBL-MergeData.xlsx")
-    today_str = datetime.now().strftime("%Y%m%d")
-    output_dir = os.path.join(base_dir, f"generated_docs_updated_{today_str}")
+def snapshot_outputs(output_dir, snapshot_dir):
+    """
+    Mirror the merged outputs into a dated snapshot directory using hard links,
+    falling back to copies where the filesystem cannot link
+    """
+    os.makedirs(snapshot_dir, exist_ok=True)
+    for name in os.listdir(output_dir):
+        source = os.path.join(output_dir, name)
+        target = os.path.join(snapshot_dir, name)
+        if os.path.exists(target):
+            os.remove(target)
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copy(source, target)
+
+def merge_document(gen_doc_path, footnote_path, section_label, out_doc_path=None):
+    """
+    Merge one footnote file into a generated document. The result is saved to
+    a temporary file of its own next to out_doc_path and renamed over it, so
+    concurrent jobs never share a file and snapshot hard links keep the old
+    content; without out_doc_path it is returned as "data" instead.
+    A generated document without the section label is passed on unchanged.
+    Returns {"output", "merged", "data", "error"}; errors are captured rather
+    than raised so one bad document cannot stop the others.
+    """
+    result = {"output": os.path.basename(gen_doc_path), "merged": False, "data": None, "error": None}
+    temp_path = None
+    try:
+        if out_doc_path is None:
+            stream = BytesIO()
+            result["merged"] = replace_section_with_footnotes(gen_doc_path, footnote_path, section_label, stream)
+            if result["merged"]:
+                result["data"] = stream.getvalue()
+            return result
+
+        fd, temp_path = tempfile.mkstemp(suffix=".docx.tmp", dir=os.path.dirname(out_doc_path))
+        os.close(fd)
+        result["merged"] = replace_section_with_footnotes(gen_doc_path, footnote_path, section_label, temp_path)
+        if not result["merged"]:
+            shutil.copy(gen_doc_path, temp_path)
+        os.replace(temp_path, out_doc_path)
+    except Exception as e:
+        print(f"Error merging {footnote_path} into {result['output']}: {e}")
+        result["error"] = traceback.format_exc()
+        if temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)
+    return result
+
+def iter_merge_documents(tasks, workers=1):
+    """
+    Run merge_document for every (generated document path, footnote path,
+    section label, output path) task, in worker processes unless workers is 1
+    (0 = one per CPU core), and yield the results in task order as they
+    arrive. At most twice as many tasks as workers are submitted ahead of the
+    result being yielded, so in-memory results do not pile up.
+    """
+    if workers == 1 or len(tasks) < 2:
+        for task in tasks:
+            yield merge_document(*task)
+        return
+    workers = workers or os.cpu_count()
+    print(f"Merging documents with {workers} workers")
+    with process_pool(workers, __name__) as executor:
+        pending = deque()
+        for task in tasks:
+            pending.append(executor.submit(merge_document, *task))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def merge_documents(tasks, workers=1):
+    """Run every task with iter_merge_documents; returns the results in task order"""
+    return list(iter_merge_documents(tasks, workers))
+
+def bundle_merged_documents(matches, bundle_path, workers=1):
+    """
+    Merge every (generated document path, footnote path, section label) in
+    matches in memory and add each result to one zip or tar archive with a
+    manifest as it arrives, instead of writing them to generated_docs_updated.
+    A document's bytes are dropped once they are in the archive, so only the
+    merges in flight are held in memory. Documents without the section label
+    go in unchanged; only errors count as failed.
+    Returns the merge results.
+    """
+    bundle = DocumentBundle(bundle_path)
+    results = []
+    try:
+        merged = iter_merge_documents([match + (None,) for match in matches], workers)
+        for (gen_doc_path, _, _), result in zip(matches, merged):
+            if result["data"] is not None:
+                bundle.add(result["output"], result["data"])
+                result["data"] = None
+            elif not result["error"]:
+                # No section to replace: passed on unchanged, as merge_document does for files
+                with open(gen_doc_path, 'rb') as f:
+                    bundle.add(result["output"], f.read())
+            results.append(result)
+    except BaseException:
+        bundle.abort()
+        raise
+    bundle.close(step="merge", failed=[result["output"] for result in results if result["error"]])
+    return results
+
+def print_merge_summary(results, elapsed):
+    """Print how many merges succeeded, which generated documents had no section to replace and which failed"""
+    merged = [result for result in results if result["merged"]]
+    unmerged = [result for result in results if not result["merged"] and not result["error"]]
+    failed = [result for result in results if result["error"]]
+    print(f"Merged {len(merged)} of {len(results)} documents in {elapsed:.1f}s")
+    if unmerged:
+        print(f"{len(unmerged)} documents had no section to replace and were passed on unchanged:")
+        for result in unmerged:
+            print(f"- {result['output']}")
+    if failed:
+        print(f"{len(failed)} documents failed:")
+        for result in failed:
+            print(f"- {result['output']}")
+            print(result["error"])
+
+def main(snapshot=False, bundle=None, workers=1, rows=None):
+    """Run step 3; rows are the prepare_rows records when the caller has already loaded them"""
+    if not os.path.isdir(footnotes_dir):
+        print(f"No updated footnote folder at {footnotes_dir}, nothing to merge")
+        return
     os.makedirs(output_dir, exist_ok=True)
 
-    # Read Excel
-    df = pd.read_excel(excel_path)
-    transcript_files = set(df['Transcript'].dropna().astype(str))
-    translate_files = set(df['Translate'].dropna().astype(str))
+    # The ledger maps each merged output to the hashes it was built from
+    ledger = load_json_file(ledger_path)
+    code_hash = "".join(file_hash(path) for path in CODE_FILES)
+    merged_outputs = set()
+    skipped = 0
+    tasks = []
+    entries_by_output = {}
+
+    # Source filename -> generated outputs, as recorded by the last build in step 2
+    source_index = load_json_file(source_index_file)
+    if not source_index:
+        print(f"No source index at {source_index_file}, indexing the workbook rows instead")
+        if rows is None:
+            df, _ = load_merge_data()
+            rows = prepare_rows(df)
+        source_index = index_records(rows)
+
+    # Documents a --prefer-updated build made from the updated footnote files are
+    # final already. They are step 2's files, even though they sit in output_dir.
+    build_manifest = load_json_file(manifest_file)
+    fused = {output for output, entry in build_manifest.items() if isinstance(entry, dict) and entry.get("updated")}
+    fused_skipped = 0
 
     # List all .docx files in DBL-UpdatedFootnotes
     footnote_files = [f for f in os.listdir(footnotes_dir) if f.lower().endswith('.docx')]
+    unmatched = []
+    matches = []
 
     for fn_file in footnote_files:
-        match_type = None
-        if fn_file in transcript_files:
-            match_type = 'Transcript'
-        elif fn_file in translate_files:
-            match_type = 'Translate'
-        else:
+        entries = source_index.get(fn_file)
+        if not entries:
+            unmatched.append(fn_file)
             continue
 
-        rows = df[df[match_type] == fn_file]
-        for _, row in rows.iterrows():
-            filename = str(row.get('Filename', ''))
-            language = str(row.get('Language', ''))
-            content_type = match_type.lower()
-            lang_code = get_lang_code(language, content_type)
-            gen_doc = f"{filename}_{lang_code}_{content_type}.docx".replace(" ", "_")
+        # A file used as a transcription source is merged as one, as before
+        match_type = 'Transcript' if any(e["content_type"] == 'Transcript' for e in entries) else 'Translate'
+        for source_entry in entries:
+            if source_entry["content_type"] != match_type:
+                continue
+            gen_doc = source_entry["output"]
+            if gen_doc in fused:
+                fused_skipped += 1
+                continue
             gen_doc_path = os.path.join(generated_dir, gen_doc)
             if not os.path.exists(gen_doc_path):
                 print(f"Generated document not found: {gen_doc_path}")
                 continue
 
-            # Copy to output directory
             out_doc_path = os.path.join(output_dir, gen_doc)
-            shutil.copy(gen_doc_path, out_doc_path)
+            footnote_path = os.path.join(footnotes_dir, fn_file)
+            section_label = "Transcription:" if match_type == "Transcript" else "Translation:"
+            if bundle:
+                matches.append((gen_doc_path, footnote_path, section_label))
+                continue
+            merged_outputs.add(gen_doc)
+
+            # Skip pairs whose footnote file and generated document are unchanged
+            entry = {
+                "footnote_file": fn_file,
+                "footnote_hash": file_hash(footnote_path),
+                "generated_hash": file_hash(gen_doc_path),
+                "code_hash": code_hash,
+            }
+            previous = ledger.get(gen_doc, {})
+            if (all(previous.get(key) == value for key, value in entry.items())
+                    and previous.get("output_hash") == file_hash(out_doc_path)):
+                skipped += 1
+                continue
 
             # Replace the section with the updated footnote file
-            section_label = "Transcription:" if match_type == "Transcript" else "Translation:"
-            footnote_path = os.path.join(footnotes_dir, fn_file)
-            print(f"Updating {out_doc_path} with {footnote_path} in section {section_label}")
-            replace_section_with_footnotes(out_doc_path, footnote_path, section_label)
+            log(f"Updating {out_doc_path} with {footnote_path} in section {section_label}", 'debug')
+            tasks.append((gen_doc_path, footnote_path, section_label, out_doc_path))
+            entries_by_output[gen_doc] = entry
+
+    start = datetime.now()
+    if bundle:
+        results = bundle_merged_documents(matches, bundle, workers)
+        print_merge_summary(results, (datetime.now() - start).total_seconds())
+        print(f"Bundle written to {bundle}")
+        return
+
+    results = merge_documents(tasks, workers)
+    for result in results:
+        gen_doc = result["output"]
+        if result["merged"]:
+            entry = entries_by_output[gen_doc]
+            entry["output_hash"] = file_hash(os.path.join(output_dir, gen_doc))
+            ledger[gen_doc] = entry
+        else:
+            ledger.pop(gen_doc, None)
 
+    # Forget outputs step 2 has since built itself, without removing its files
+    for gen_doc in sorted(fused & set(ledger)):
+        del ledger[gen_doc]
+
+    # Remove merged outputs whose footnote file or row no longer exists
+    for gen_doc in sorted(set(ledger) - merged_outputs):
+        orphan_path = os.path.join(output_dir, gen_doc)
+        if os.path.exists(orphan_path):
+            os.remove(orphan_path)
+            print(f"Removed orphaned merged document: {gen_doc}")
+        del ledger[gen_doc]
+    save_json_file(ledger_path, ledger)
+
+    print_merge_summary(results, (datetime.now() - start).total_seconds())
+    print(f"Skipped {skipped} unchanged documents")
+    if fused_skipped:
+        print(f"Left {fused_skipped} documents built from updated footnote files by step 2 (--prefer-updated) as they are")
+    if unmatched:
+        print(f"{len(unmatched)} footnote files match no generated document:")
+        for fn_file in sorted(unmatched):
+            print(f"- {fn_file}")
     print(f"All updates complete. Output in {output_dir}")
 
+    if snapshot:
+        today_str = datetime.now().strftime("%Y%m%d")
+        snapshot_dir = os.path.join(base_dir, f"generated_docs_updated_{today_str}")
+        snapshot_outputs(output_dir, snapshot_dir)
+        print(f"Snapshot linked into {snapshot_dir}")
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Merge updated footnote files into the generated documents")
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument("--snapshot", action="store_true",
+                        help="Also hard-link the merged outputs into a dated generated_docs_updated_YYYYMMDD directory")
+    output.add_argument("--bundle", default=None,
+                        help="Merge every matched document into this .zip or .tar archive (with a manifest) "
+                             "instead of generated_docs_updated")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of worker processes (1 = serial, 0 = one per CPU core)")
+    parser.add_argument("--log-level", choices=list(LOG_LEVELS), default=None,
+                        help="Console verbosity; 'debug' prints every document merged (default: info)")
+    args = parser.parse_args()
+    if args.log_level:
+        set_log_level(args.log_level)
+    main(snapshot=args.snapshot, bundle=args.bundle, workers=args.workers)
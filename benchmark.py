@@ -0,0 +1,504 @@
+import os
+import io
+import sys
+import copy
+import json
+import time
+import shutil
+import argparse
+import datetime
+import tempfile
+import platform
+import contextlib
+import subprocess
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from docx import Document
+from docx.oxml import parse_xml
+from docx.oxml.ns import qn
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.opc.oxml import serialize_part_xml
+from saa_common import load_merge_data, read_workbook, load_script
+from run_report import StageTimer, peak_rss_mb
+import footnote_merge
+
+# Define paths
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sources_dir = os.path.join(current_dir, 'data', 'transcriptions-translations')
+default_results_file = os.path.join(current_dir, 'temp', 'benchmark_results.json')
+
+# Stages timed by the benchmark suite, in the order they run
+STAGES = ['read_workbook', 'add_metadata_fields', 'copy_content_from_source',
+          'create_document', 'replace_section_with_footnotes']
+
+SAMPLE_TEXT = ("Wy ondergeschreven verklaren hiermede dat de broeders in Switserland "
+               "door de overheyt vervolght worden en onse hulpe van noode hebben. ")
+
+def load_rows(limit):
+    """Load spreadsheet rows from the data store"""
+    df, _ = load_merge_data()
+    return df.head(limit)
+
+def git_revision():
+    """Short git revision of the working tree, or None outside a git checkout"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=current_dir,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# ---------------------------------------------------------------------------
+# Synthetic corpus
+# ---------------------------------------------------------------------------
+
+def find_skeleton_source():
+    """Pick the first real source document with a footnotes part as the styling skeleton"""
+    for name in sorted(os.listdir(sources_dir)):
+        if not name.lower().endswith('.docx'):
+            continue
+        doc = Document(os.path.join(sources_dir, name))
+        if any(rel.reltype == RT.FOOTNOTES for rel in doc.part.rels.values()):
+            return os.path.join(sources_dir, name)
+    raise FileNotFoundError(f"No source document with footnotes found in {sources_dir}")
+
+def make_source_document(path, paragraphs, footnotes, tables, sections):
+    """
+    Write a synthetic source document with the given number of paragraphs,
+    footnotes, 3x3 tables and sections, reusing the styles of a real source
+    """
+    doc = Document(find_skeleton_source())
+    body = doc.element.body
+    for child in list(body):
+        if child.tag != qn('w:sectPr'):
+            body.remove(child)
+
+    # Keep the separator footnotes, drop the real ones
+    footnote_part = doc.part.rels.part_with_reltype(RT.FOOTNOTES)
+    footnotes_xml = parse_xml(footnote_part.blob)
+    for footnote in footnotes_xml.findall(qn('w:footnote')):
+        if footnote.get(qn('w:type')) is None:
+            footnotes_xml.remove(footnote)
+    next_id = max([int(f.get(qn('w:id'))) for f in footnotes_xml.findall(qn('w:footnote'))] + [0]) + 1
+
+    paragraphs = max(paragraphs, 1)
+    added = []
+    for i in range(paragraphs):
+        para = doc.add_paragraph(f"{i + 1}. {SAMPLE_TEXT * 3}")
+        added.append(para)
+
+    # Spread footnote references evenly over the paragraphs
+    for n in range(footnotes):
+        para = added[n * paragraphs // footnotes]
+        run = para.add_run()
+        run.font.superscript = True
+        ref = run._r.makeelement(qn('w:footnoteReference'), {qn('w:id'): str(next_id + n)})
+        run._r.append(ref)
+        footnote = parse_xml(
+            f'<w:footnote xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main" '
+            f'w:id="{next_id + n}"><w:p><w:r><w:t xml:space="preserve">Footnote {n + 1}: '
+            f'{SAMPLE_TEXT}</w:t></w:r></w:p></w:footnote>')
+        footnotes_xml.append(footnote)
+    footnote_part._blob = serialize_part_xml(footnotes_xml)
+
+    # Insert tables after evenly spaced paragraphs
+    for n in range(tables):
+        table = doc.add_table(rows=3, cols=3)
+        for cell in table._cells:
+            cell.text = "1710"
+        added[n * paragraphs // tables]._p.addnext(table._tbl)
+
+    # End every section but the last with a section break in its final paragraph
+    for n in range(1, sections):
+        para = added[n * paragraphs // sections - 1]
+        para._p.get_or_add_pPr().append(copy.deepcopy(body.sectPr))
+
+    doc.save(path)
+
+def make_corpus(corpus_dir, documents, paragraphs, footnotes, tables, sections):
+    """
+    Create a synthetic workbook and source folder under corpus_dir.
+    Returns the workbook path; sources go in corpus_dir/transcriptions-translations.
+    """
+    source_dir = os.path.join(corpus_dir, 'transcriptions-translations')
+    os.makedirs(source_dir, exist_ok=True)
+    prototype = os.path.join(corpus_dir, 'prototype.docx')
+    make_source_document(prototype, paragraphs, footnotes, tables, sections)
+
+    languages = ['Dutch', 'German', 'French']
+    rows = []
+    for i in range(documents):
+        transcript = f"bench_{i:05d}-Src.docx"
+        translate = f"bench_{i:05d}-Eng.docx"
+        shutil.copy(prototype, os.path.join(source_dir, transcript))
+        shutil.copy(prototype, os.path.join(source_dir, translate))
+        rows.append({
+            'Digital ID': 9000 + i / 100,
+            'Sender': "Synthetic Sender",
+            'Sender Place': "Amsterdam, North Holland, Netherlands",
+            'Receiver': "Synthetic Receiver" if i % 2 else None,
+            'Receiver Place': "Bern, Switzerland",
+            'Date': "10 October 1710",
+            'Filename': f"BENCH_{i:05d}_01",
+            'Transcript': transcript,
+            'Translate': translate,
+            'Language': languages[i % len(languages)],
+            'DBL - Doc number': i + 1,
+            'Transcript range': f"{2 * i}-{2 * i + 1}",
+            'Translate range': f"{2 * i + 1}-{2 * i + 2}",
+            ' volume': 'II',
+        })
+    workbook = os.path.join(corpus_dir, 'bench-MergeData.xlsx')
+    pd.DataFrame(rows).to_excel(workbook, index=False)
+    return workbook
+
+# ---------------------------------------------------------------------------
+# Stages (each runs in its own process so its peak RSS can be measured)
+# ---------------------------------------------------------------------------
+
+def iter_documents(df):
+    """Yield (row, content_type) for every document the rows call for"""
+    for _, row in df.iterrows():
+        for content_type in ('Transcript', 'Translate'):
+            if not pd.isna(row.get(content_type, pd.NA)):
+                yield row, content_type
+
+def run_stage(stage, corpus_dir, workbook):
+    """Run one stage over the corpus and return its per-item timings and peak RSS"""
+    build = load_script('build_document_and_header')
+    build.data_folder = corpus_dir
+    build.OUTPUT_DIR = os.path.join(corpus_dir, 'generated')
+    os.makedirs(build.OUTPUT_DIR, exist_ok=True)
+    df = read_workbook(workbook)
+    timings = []
+
+    def timed(fn, *args):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = fn(*args)
+        timings.append(time.perf_counter() - start)
+        return result
+
+    def fresh_document():
+        with contextlib.redirect_stdout(io.StringIO()):
+            doc = Document(BytesIO(build.get_clean_template()))
+        return doc
+
+    if stage == 'read_workbook':
+        for _ in range(5):
+            timed(read_workbook, workbook)
+    elif stage == 'add_metadata_fields':
+        for row, content_type in iter_documents(df):
+            timed(build.add_metadata_fields, fresh_document(), row, content_type)
+    elif stage == 'copy_content_from_source':
+        for row, content_type in iter_documents(df):
+            timed(build.copy_content_from_source, fresh_document(), row, content_type,
+                  corpus_dir, 'benchmark.docx')
+    elif stage == 'create_document':
+        for row, content_type in iter_documents(df):
+            timed(build.create_document, row, content_type)
+    elif stage == 'replace_section_with_footnotes':
+        merge = load_script('merge_good_format')
+        target_dir = os.path.join(corpus_dir, 'merged')
+        os.makedirs(target_dir, exist_ok=True)
+        for row, content_type in iter_documents(df):
+            with contextlib.redirect_stdout(io.StringIO()):
+                generated = build.create_document(row, content_type)
+            target = os.path.join(target_dir, os.path.basename(generated))
+            shutil.copy(generated, target)
+            source = os.path.join(corpus_dir, 'transcriptions-translations', row[content_type])
+            label = "Transcription:" if content_type == 'Transcript' else "Translation:"
+            timed(merge.replace_section_with_footnotes, target, source, label)
+    else:
+        raise ValueError(f"Unknown stage: {stage}")
+
+    return {"timings": timings, "peak_rss_mb": peak_rss_mb()}
+
+def summarize(timings):
+    """Aggregate per-item timings into the numbers we compare between versions"""
+    ordered = sorted(timings)
+    total = sum(ordered)
+    return {
+        "count": len(ordered),
+        "total_s": total,
+        "mean_ms": 1000 * total / len(ordered),
+        "p50_ms": 1000 * ordered[len(ordered) // 2],
+        "p95_ms": 1000 * ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        "per_second": len(ordered) / total if total else None,
+    }
+
+def benchmark_suite(documents, paragraphs, footnotes, tables, sections, stages, output):
+    """Build a synthetic corpus, time each stage and write the results as JSON"""
+    corpus = {"documents": documents, "paragraphs": paragraphs, "footnotes": footnotes,
+              "tables": tables, "sections": sections}
+    results = {
+        "meta": {
+            "timestamp": datetime.datetime.now().isoformat(timespec='seconds'),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "corpus": corpus,
+        },
+        "stages": {},
+    }
+
+    with tempfile.TemporaryDirectory() as corpus_dir:
+        print(f"Creating synthetic corpus: {corpus}")
+        workbook = make_corpus(corpus_dir, **corpus)
+        for stage in stages:
+            # A fresh process per stage keeps peak RSS readings independent
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                outcome = executor.submit(run_stage, stage, corpus_dir, workbook).result()
+            summary = summarize(outcome["timings"])
+            summary["peak_rss_mb"] = outcome["peak_rss_mb"]
+            results["stages"][stage] = summary
+
+    print_results(results)
+    if output:
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults saved to {output}")
+    return results
+
+def print_results(results):
+    """Print one line per stage"""
+    print(f"\n{'stage':<32}{'n':>6}{'mean ms':>10}{'p95 ms':>10}{'per s':>9}{'peak MB':>9}")
+    for stage, summary in results["stages"].items():
+        rss = summary["peak_rss_mb"]
+        print(f"{stage:<32}{summary['count']:>6}{summary['mean_ms']:>10.1f}{summary['p95_ms']:>10.1f}"
+              f"{summary['per_second'] or 0:>9.1f}{rss if rss is not None else float('nan'):>9.1f}")
+
+def compare_results(baseline_file, candidate_file):
+    """Print the change in mean time and peak RSS per stage between two result files"""
+    with open(baseline_file, encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(candidate_file, encoding='utf-8') as f:
+        candidate = json.load(f)
+    if baseline["meta"]["corpus"] != candidate["meta"]["corpus"]:
+        print("Warning: the two runs used different synthetic corpora")
+
+    print(f"{'stage':<32}{'base ms':>10}{'new ms':>10}{'change':>9}{'base MB':>9}{'new MB':>9}")
+    for stage, new in candidate["stages"].items():
+        old = baseline["stages"].get(stage)
+        if old is None:
+            continue
+        change = 100 * (new["mean_ms"] / old["mean_ms"] - 1)
+        print(f"{stage:<32}{old['mean_ms']:>10.1f}{new['mean_ms']:>10.1f}{change:>+8.0f}%"
+              f"{old['peak_rss_mb'] or float('nan'):>9.1f}{new['peak_rss_mb'] or float('nan'):>9.1f}")
+
+# ---------------------------------------------------------------------------
+# Compose pipeline comparison (old temp-file round trips vs in-memory)
+# ---------------------------------------------------------------------------
+
+class DiskWriteCounter:
+    """Tallies the package serializations that hit the disk during a build"""
+    def __init__(self):
+        self.writes = 0
+        self.bytes = 0
+
+    def record(self, path):
+        self.writes += 1
+        self.bytes += os.path.getsize(path)
+
+def make_round_trip_copy_content(build, counter):
+    """
+    Reproduce the old temp-file pipeline around copy_content_from_source:
+    save the document twice, reload it as the compose master, then save and
+    reload the composed result before create_document's final save.
+    """
+    in_memory_copy_content = build.copy_content_from_source
+
+    def round_trip_copy_content(doc, row, content_type, data_folder, output_filename, index=None,
+                                source_path=None):
+        with tempfile.NamedTemporaryFile(suffix='.docx', delete=False) as temp_file:
+            temp_path = temp_file.name
+        with tempfile.NamedTemporaryFile(suffix='.docx', delete=False) as result_file:
+            result_path = result_file.name
+        try:
+            doc.save(temp_path)
+            counter.record(temp_path)
+            doc.save(temp_path)
+            counter.record(temp_path)
+            master = Document(temp_path)
+            result_doc = in_memory_copy_content(master, row, content_type, data_folder, output_filename,
+                                                source_path=source_path)
+            result_doc.save(result_path)
+            counter.record(result_path)
+            return Document(result_path)
+        finally:
+            os.unlink(temp_path)
+            os.unlink(result_path)
+
+    return round_trip_copy_content
+
+def time_documents(build, df, counter):
+    """Build every document for the rows in df and return the per-document wall times"""
+    timings = []
+    for row, content_type in iter_documents(df):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            output_path = build.create_document(row, content_type)
+        timings.append(time.perf_counter() - start)
+        counter.record(output_path)
+    return timings
+
+def benchmark_compose(rows):
+    """Compare the old temp-file compose pipeline against the in-memory one"""
+    build = load_script('build_document_and_header')
+    df = load_rows(rows)
+    in_memory_copy_content = build.copy_content_from_source
+    results = {}
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        build.OUTPUT_DIR = output_dir
+        # Warm up imports and lazily built python-docx state before timing
+        time_documents(build, df.head(1), DiskWriteCounter())
+        for mode in ('round-trip', 'in-memory'):
+            counter = DiskWriteCounter()
+            if mode == 'round-trip':
+                build.copy_content_from_source = make_round_trip_copy_content(build, counter)
+            else:
+                build.copy_content_from_source = in_memory_copy_content
+            timings = time_documents(build, df, counter)
+            results[mode] = {
+                "documents": len(timings),
+                "ms_per_doc": 1000 * sum(timings) / len(timings),
+                "writes_per_doc": counter.writes / len(timings),
+                "kb_per_doc": counter.bytes / 1024 / len(timings),
+            }
+
+    print(f"{'mode':<12}{'docs':>6}{'ms/doc':>10}{'writes/doc':>12}{'KB/doc':>10}")
+    for mode, result in results.items():
+        print(f"{mode:<12}{result['documents']:>6}{result['ms_per_doc']:>10.1f}"
+              f"{result['writes_per_doc']:>12.1f}{result['kb_per_doc']:>10.1f}")
+
+    old, new = results['round-trip'], results['in-memory']
+    print(f"\nWall time per document: {100 * (1 - new['ms_per_doc'] / old['ms_per_doc']):.0f}% lower")
+    print(f"Disk writes per document: {old['writes_per_doc']:.0f} -> {new['writes_per_doc']:.0f}")
+    return results
+
+# ---------------------------------------------------------------------------
+# Footnote merge comparison (docxcompose vs the direct lxml merge)
+# ---------------------------------------------------------------------------
+
+def benchmark_merge(rows):
+    """Compare composing sources with docxcompose against the direct footnote merge on real rows"""
+    build = load_script('build_document_and_header')
+    df = load_rows(rows)
+    results = {}
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        build.OUTPUT_DIR = output_dir
+        time_documents(build, df.head(1), DiskWriteCounter())
+        for mode in ('docxcompose', 'direct'):
+            footnote_merge.DIRECT_MERGE = mode == 'direct'
+            compose_times = []
+            total_times = []
+            for row, content_type in iter_documents(df):
+                timer = StageTimer()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    build.create_document(row, content_type, timer)
+                compose_times.append(timer.stages["compose"])
+                total_times.append(timer.total_ms)
+            compose_times.sort()
+            results[mode] = {
+                "documents": len(total_times),
+                "compose_ms": sum(compose_times) / len(compose_times),
+                "compose_p95_ms": compose_times[min(len(compose_times) - 1, int(len(compose_times) * 0.95))],
+                "compose_max_ms": compose_times[-1],
+                "ms_per_doc": sum(total_times) / len(total_times),
+            }
+    footnote_merge.DIRECT_MERGE = True
+
+    print(f"{'mode':<12}{'docs':>6}{'compose ms':>12}{'p95 ms':>10}{'max ms':>10}{'ms/doc':>10}")
+    for mode, result in results.items():
+        print(f"{mode:<12}{result['documents']:>6}{result['compose_ms']:>12.1f}{result['compose_p95_ms']:>10.1f}"
+              f"{result['compose_max_ms']:>10.1f}{result['ms_per_doc']:>10.1f}")
+    old, new = results['docxcompose'], results['direct']
+    print(f"\nCompose time per document: {old['compose_ms'] / new['compose_ms']:.1f}x faster")
+    return results
+
+# ---------------------------------------------------------------------------
+# Startup time (separate step scripts vs the single-process saa_build.py)
+# ---------------------------------------------------------------------------
+
+# (label, commands run by the Makefile before, the saa_build.py equivalent)
+STARTUP_COMMANDS = [
+    ("help", [["02_build_document_and_header.py", "--help"]], ["saa_build.py", "--help"]),
+    ("check", [["02_build_document_and_header.py", "--check"]], ["saa_build.py", "check"]),
+    ("restamp", [["02_build_document_and_header.py", "--restamp"]], ["saa_build.py", "restamp"]),
+    ("pipeline", [["01_load_excel_data.py"], ["02_build_document_and_header.py"], ["03_merge_good_format.py"]],
+     ["saa_build.py", "all"]),
+]
+
+def time_commands(commands, repeat):
+    """Median wall time in seconds of running the scripts one after another, each in a new interpreter"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for command in commands:
+            subprocess.run([sys.executable] + command, cwd=current_dir, stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+def benchmark_startup(repeat):
+    """
+    Time the command-line entry points from a cold interpreter. Run on an
+    up-to-date tree, restamp and the pipeline touch no documents, so their
+    times are the fixed cost of imports and loading the rows.
+    """
+    results = {}
+    for label, scripts, command in STARTUP_COMMANDS:
+        # One untimed run so both sides start with a warm data store and manifest
+        time_commands([command], 1)
+        results[label] = {"scripts_s": time_commands(scripts, repeat), "saa_build_s": time_commands([command], repeat)}
+
+    print(f"{'command':<12}{'scripts s':>11}{'saa_build s':>13}{'change':>9}")
+    for label, result in results.items():
+        change = 100 * (result["saa_build_s"] / result["scripts_s"] - 1)
+        print(f"{label:<12}{result['scripts_s']:>11.2f}{result['saa_build_s']:>13.2f}{change:>+8.0f}%")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the document build and merge pipeline")
+    subparsers = parser.add_subparsers(dest="command")
+
+    suite = subparsers.add_parser("suite", help="Time each pipeline stage on a synthetic corpus (default)")
+    suite.add_argument("--documents", type=int, default=10, help="Spreadsheet rows (two documents each)")
+    suite.add_argument("--paragraphs", type=int, default=200, help="Paragraphs per source document")
+    suite.add_argument("--footnotes", type=int, default=40, help="Footnotes per source document")
+    suite.add_argument("--tables", type=int, default=2, help="Tables per source document")
+    suite.add_argument("--sections", type=int, default=1, help="Sections per source document")
+    suite.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES, help="Stages to run")
+    suite.add_argument("--output", default=default_results_file, help="JSON results file")
+
+    compare = subparsers.add_parser("compare", help="Compare two JSON result files")
+    compare.add_argument("baseline")
+    compare.add_argument("candidate")
+
+    compose = subparsers.add_parser("compose", help="Compare temp-file and in-memory composing on real rows")
+    compose.add_argument("--rows", type=int, default=20, help="Number of spreadsheet rows to build")
+
+    merge = subparsers.add_parser("merge", help="Compare docxcompose and the direct footnote merge on real rows")
+    merge.add_argument("--rows", type=int, default=20, help="Number of spreadsheet rows to build")
+
+    startup = subparsers.add_parser("startup", help="Compare the startup time of the step scripts and saa_build.py")
+    startup.add_argument("--repeat", type=int, default=5, help="Runs of each command (the median is reported)")
+
+    args = parser.parse_args()
+    if args.command == "startup":
+        benchmark_startup(args.repeat)
+    elif args.command == "merge":
+        benchmark_merge(args.rows)
+    elif args.command == "compare":
+        compare_results(args.baseline, args.candidate)
+    elif args.command == "compose":
+        benchmark_compose(args.rows)
+    else:
+        if args.command is None:
+            args = suite.parse_args([])
+        benchmark_suite(args.documents, args.paragraphs, args.footnotes, args.tables,
+                        args.sections, args.stages, args.output)
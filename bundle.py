@@ -0,0 +1,73 @@
+import os
+import io
+import json
+import time
+import tarfile
+import zipfile
+import datetime
+import hashlib
+
+# Name of the manifest member written at the end of every bundle
+MANIFEST_NAME = 'manifest.json'
+
+class DocumentBundle:
+    """
+    Single zip or tar archive that generated documents are streamed into
+    instead of being written as individual files. The format follows the
+    extension: .zip, or .tar / .tar.gz / .tgz. Zip members are stored
+    without compression, since a .docx is already deflated.
+
+    add() appends one document under its base name. close() appends
+    manifest.json (name, size and SHA-256 of every document, plus the
+    meta given) and moves the archive into place; until then it is
+    written to a temporary file next to the target.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.temp_path = path + ".tmp"
+        self.documents = []
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        lower = path.lower()
+        if lower.endswith('.zip'):
+            self._zip = zipfile.ZipFile(self.temp_path, 'w', zipfile.ZIP_STORED)
+            self._tar = None
+        elif lower.endswith(('.tar', '.tar.gz', '.tgz')):
+            self._zip = None
+            self._tar = tarfile.open(self.temp_path, 'w:gz' if lower.endswith('gz') else 'w')
+        else:
+            raise ValueError(f"Unsupported bundle format {path} (use .zip, .tar, .tar.gz or .tgz)")
+
+    def add(self, path, data):
+        """Append data as the member named after path's base name"""
+        name = os.path.basename(path)
+        self._write(name, data)
+        self.documents.append({
+            "name": name,
+            "bytes": len(data),
+            "sha256": hashlib.sha256(data).hexdigest(),
+        })
+
+    def _write(self, name, data):
+        if self._zip is not None:
+            self._zip.writestr(zipfile.ZipInfo(name, time.localtime()[:6]), data)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = time.time()
+            self._tar.addfile(info, io.BytesIO(data))
+
+    def close(self, **meta):
+        """Write the manifest, finish the archive and move it into place"""
+        manifest = dict(meta, created=datetime.datetime.now().isoformat(timespec='seconds'),
+                        documents=self.documents)
+        self._write(MANIFEST_NAME, json.dumps(manifest, indent=2).encode('utf-8'))
+        (self._zip or self._tar).close()
+        os.replace(self.temp_path, self.path)
+
+    def abort(self):
+        """Discard a partly written archive"""
+        (self._zip or self._tar).close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
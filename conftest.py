@@ -0,0 +1,36 @@
+import os
+import sys
+import pytest
+from saa_common import load_script
+
+def fresh_script(name):
+    """Load a step script anew, so module attributes a test changes (OUTPUT_DIR, ...) do not leak"""
+    sys.modules.pop(name, None)
+    module = load_script(name)
+    yield module
+    sys.modules.pop(name, None)
+
+@pytest.fixture
+def build():
+    """02_build_document_and_header.py"""
+    yield from fresh_script('build_document_and_header')
+
+@pytest.fixture
+def merge():
+    """03_merge_good_format.py"""
+    yield from fresh_script('merge_good_format')
+
+@pytest.fixture
+def tmp_folders(tmp_path, build):
+    """
+    Point the build fixture's output folders, updated footnote folder, build
+    manifest and source index at tmp_path (sources and the template are still
+    read from data/)
+    """
+    build.OUTPUT_DIR = str(tmp_path / "generated")
+    build.UPDATED_DIR = str(tmp_path / "updated")
+    build.updated_folder = str(tmp_path / "footnotes")
+    build.manifest_file = str(tmp_path / "manifest.json")
+    build.source_index_file = str(tmp_path / "source_index.json")
+    for folder in (build.OUTPUT_DIR, build.UPDATED_DIR, build.updated_folder):
+        os.makedirs(folder)
@@ -0,0 +1,114 @@
+import os
+import zlib
+import struct
+import zipfile
+
+# Fixed-size records of the zip format (see APPNOTE.TXT sections 4.3.7, 4.3.12 and 4.3.16)
+LOCAL_HEADER = struct.Struct("<4s2B4HL2L2H")
+CENTRAL_HEADER = struct.Struct("<4s4B4HL2L5H2L")
+END_OF_CENTRAL_DIR = struct.Struct("<4s4H2LH")
+LOCAL_SIGNATURE = b"PK\x03\x04"
+CENTRAL_SIGNATURE = b"PK\x01\x02"
+END_SIGNATURE = b"PK\x05\x06"
+
+class UnsupportedPackage(Exception):
+    """The package uses zip features the raw member copy does not handle (zip64, spanning)"""
+
+def _compress(data):
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush()
+
+def _read_central_directory(data):
+    """Return (central directory entries, central directory offset) of a zip held in data"""
+    end = data.rfind(END_SIGNATURE, max(0, len(data) - END_OF_CENTRAL_DIR.size - 0xFFFF))
+    if end < 0:
+        raise zipfile.BadZipFile("End of central directory not found")
+    _, disk, cd_disk, disk_entries, entries, cd_size, cd_offset, _ = END_OF_CENTRAL_DIR.unpack_from(data, end)
+    if disk or cd_disk or disk_entries != entries or entries == 0xFFFF or 0xFFFFFFFF in (cd_size, cd_offset):
+        raise UnsupportedPackage("Spanned or zip64 archive")
+
+    records = []
+    position = cd_offset
+    for _ in range(entries):
+        fields = list(CENTRAL_HEADER.unpack_from(data, position))
+        if fields[0] != CENTRAL_SIGNATURE:
+            raise zipfile.BadZipFile("Bad central directory entry")
+        name_length, extra_length, comment_length = fields[12:15]
+        variable = data[position + CENTRAL_HEADER.size:
+                        position + CENTRAL_HEADER.size + name_length + extra_length + comment_length]
+        flags = fields[5]
+        name = variable[:name_length].decode('utf-8' if flags & 0x800 else 'cp437')
+        records.append({"name": name, "fields": fields, "variable": variable})
+        position += CENTRAL_HEADER.size + len(variable)
+    return records, cd_offset
+
+def _rewrite_package(path, replacements):
+    """Slow path: rewrite the whole package with zipfile, recompressing every member"""
+    temp_path = path + ".tmp"
+    replaced = 0
+    with zipfile.ZipFile(path) as source, zipfile.ZipFile(temp_path, 'w', zipfile.ZIP_DEFLATED) as target:
+        for info in source.infolist():
+            if info.filename in replacements:
+                target.writestr(info, replacements[info.filename], zipfile.ZIP_DEFLATED)
+                replaced += 1
+            else:
+                target.writestr(info, source.read(info))
+    os.replace(temp_path, path)
+    return replaced
+
+def replace_package_members(path, replacements):
+    """
+    Rewrite the zip package at path with the members named in replacements
+    (name -> bytes) replaced. Every other member is copied byte for byte,
+    compressed data included, so nothing is decompressed or recompressed; only
+    the replaced members are deflated. The new package replaces the old one
+    atomically. Returns the number of members replaced.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    try:
+        records, cd_offset = _read_central_directory(data)
+    except UnsupportedPackage:
+        return _rewrite_package(path, replacements)
+
+    # Each member's local record (header, data and any data descriptor) runs up to
+    # the next member's local header, or to the central directory for the last one
+    offsets = sorted(record["fields"][18] for record in records) + [cd_offset]
+    record_end = {start: end for start, end in zip(offsets, offsets[1:])}
+
+    output = bytearray()
+    central = bytearray()
+    replaced = 0
+    for record in records:
+        fields = record["fields"]
+        header_offset = fields[18]
+        fields[18] = len(output)
+
+        if record["name"] in replacements:
+            content = replacements[record["name"]]
+            compressed = _compress(content)
+            name = record["variable"][:fields[12]]
+            flags = fields[5] & 0x800  # keep the UTF-8 name flag, no data descriptor
+            crc = zlib.crc32(content)
+            output += LOCAL_HEADER.pack(LOCAL_SIGNATURE, 20, 0, flags, zipfile.ZIP_DEFLATED,
+                                        fields[7], fields[8], crc, len(compressed), len(content),
+                                        len(name), 0)
+            output += name + compressed
+            fields[3], fields[5], fields[6] = max(fields[3], 20), flags, zipfile.ZIP_DEFLATED
+            fields[9], fields[10], fields[11] = crc, len(compressed), len(content)
+            replaced += 1
+        else:
+            output += data[header_offset:record_end[header_offset]]
+
+        central += CENTRAL_HEADER.pack(*fields) + record["variable"]
+
+    cd_start = len(output)
+    output += central
+    output += END_OF_CENTRAL_DIR.pack(END_SIGNATURE, 0, 0, len(records), len(records),
+                                      len(central), cd_start, 0)
+
+    temp_path = path + ".tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(output)
+    os.replace(temp_path, path)
+    return replaced
@@ -0,0 +1,244 @@
+import os
+from copy import deepcopy
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.opc.oxml import serialize_part_xml
+from docx.oxml import parse_xml
+from docx.oxml.ns import qn
+from saa_common import log
+
+# Set SAA_DIRECT_MERGE=0 to always compose with docxcompose
+DIRECT_MERGE = os.environ.get("SAA_DIRECT_MERGE", "1") != "0"
+
+R_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+WP_NS = "http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing"
+STYLE_REFERENCES = (qn('w:pStyle'), qn('w:rStyle'), qn('w:tblStyle'))
+
+# How many documents went through each path in this process
+merge_counts = {"direct": 0, "composer": 0}
+
+def _footnotes_by_id(part):
+    """Parse a footnotes part and index its footnotes by id"""
+    root = parse_xml(part.blob)
+    return root, {footnote.get(qn('w:id')): footnote for footnote in root.iterchildren(qn('w:footnote'))}
+
+def _styles_by_id(styles_element):
+    return {style.get(qn('w:styleId')): style for style in styles_element.iterchildren(qn('w:style'))}
+
+def _style_name(style):
+    name = style.find(qn('w:name'))
+    return None if name is None else name.get(qn('w:val'))
+
+def _referenced_style_ids(elements):
+    """Style ids referenced from the elements, in document order without duplicates"""
+    ids = {}
+    for element in elements:
+        for tag in STYLE_REFERENCES:
+            for ref in element.iter(tag):
+                ids.setdefault(ref.get(qn('w:val')), None)
+    return list(ids)
+
+def _has_relationship_attributes(element):
+    """Whether any element below element points at a package relationship (r:id, r:embed, ...)"""
+    return any(attribute.startswith(f"{{{R_NS}}}")
+               for node in element.iter() if isinstance(node.tag, str)
+               for attribute in node.attrib)
+
+def unsupported_reason(target_doc, source_doc):
+    """
+    Return why source_doc cannot be merged directly into target_doc, or None if it can.
+    The direct merge handles body text, tables, text boxes, bookmarks, styles and
+    footnotes. Anything that needs docxcompose's part, numbering or section
+    reconciliation is left to Composer.
+    """
+    try:
+        target_doc.part.rels.part_with_reltype(RT.FOOTNOTES)
+    except KeyError:
+        return "target has no footnotes part"
+
+    body = source_doc.element.body
+    for element in body:
+        if element.tag == qn('w:sectPr'):
+            continue
+        if _has_relationship_attributes(element):
+            return "body references package parts (images, hyperlinks or charts)"
+        if element.find('.//' + qn('w:sectPr')) is not None:
+            return "multiple sections"
+        if element.find('.//' + qn('w:numPr')) is not None:
+            return "numbered paragraphs"
+        for tag in ('w:endnoteReference', 'w:commentReference', 'w:altChunk'):
+            if element.find('.//' + qn(tag)) is not None:
+                return f"unsupported element {tag}"
+        for instr in element.iter(qn('w:instrText')):
+            if instr.text and 'DOCPROPERTY' in instr.text:
+                return "document property fields"
+
+    styled = [body]
+    if body.find('.//' + qn('w:footnoteReference')) is not None:
+        footnotes, _ = _footnotes_by_id(source_doc.part.rels.part_with_reltype(RT.FOOTNOTES))
+        if _has_relationship_attributes(footnotes):
+            return "footnotes reference package parts"
+        if footnotes.find('.//' + qn('w:numPr')) is not None:
+            return "numbered footnotes"
+        styled.append(footnotes)
+
+    # Styles with numbering need Composer's numbering import and restart logic
+    source_styles = _styles_by_id(source_doc.styles.element)
+    target_styles_by_name = {_style_name(style): style
+                             for style in target_doc.styles.element.iterchildren(qn('w:style'))}
+    pending = _referenced_style_ids(styled)
+    seen = set()
+    while pending:
+        style_id = pending.pop()
+        style = source_styles.get(style_id)
+        if style_id in seen or style is None:
+            continue
+        seen.add(style_id)
+        target_style = target_styles_by_name.get(_style_name(style))
+        for candidate in (style, target_style):
+            if candidate is not None and candidate.find('.//' + qn('w:numPr')) is not None:
+                return f"numbered style {style_id}"
+        for tag in ('w:basedOn', 'w:link', 'w:next'):
+            ref = style.find(qn(tag))
+            if ref is not None:
+                pending.append(ref.get(qn('w:val')))
+    return None
+
+def _add_styles(target_doc, source_doc, elements):
+    """
+    Copy the styles the elements reference (and the styles those are based on or
+    linked to) from the source into the target, mapping style ids by style name
+    like Composer does, and rewrite the references to the target's ids.
+    """
+    source_styles = _styles_by_id(source_doc.styles.element)
+    target_root = target_doc.styles.element
+    target_styles = _styles_by_id(target_root)
+    target_ids_by_name = {_style_name(style): style_id for style_id, style in target_styles.items()}
+
+    def mapped_id(style_id):
+        style = source_styles.get(style_id)
+        if style is None:
+            return style_id
+        return target_ids_by_name.get(_style_name(style), style_id)
+
+    pending = _referenced_style_ids(elements)
+    seen = set()
+    while pending:
+        style_id = pending.pop(0)
+        if style_id in seen:
+            continue
+        seen.add(style_id)
+        our_id = mapped_id(style_id)
+        if our_id not in target_styles and style_id in source_styles:
+            style = deepcopy(source_styles[style_id])
+            target_root.append(style)
+            target_styles[style_id] = style
+            target_ids_by_name[_style_name(style)] = style_id
+            for tag in ('w:basedOn', 'w:link', 'w:next'):
+                ref = style.find(qn(tag))
+                if ref is not None:
+                    pending.append(ref.get(qn('w:val')))
+        if our_id != style_id:
+            for element in elements:
+                for tag in STYLE_REFERENCES:
+                    for ref in element.iter(tag):
+                        if ref.get(qn('w:val')) == style_id:
+                            ref.set(qn('w:val'), our_id)
+
+def _max_int_attribute(elements, tag, attribute):
+    values = [int(node.get(attribute)) for element in elements for node in element.iter(tag)
+              if node.get(attribute, '').lstrip('-').isdigit()]
+    return max(values, default=0)
+
+def _renumber(elements, tag, attribute, start):
+    """Give the id attribute of every tag below elements a new id from start upward, keeping pairs together"""
+    mapping = {}
+    for element in elements:
+        for node in element.iter(tag):
+            old = node.get(attribute)
+            if old not in mapping:
+                mapping[old] = str(start + len(mapping))
+            node.set(attribute, mapping[old])
+    return mapping
+
+def _merge_directly(target_doc, index, source_doc, consume=False):
+    """
+    Insert the source body at index, carrying footnotes, styles, bookmarks and
+    drawing ids. With consume, body elements and footnotes are moved out of the
+    source instead of copied.
+    """
+    take = (lambda element: element) if consume else deepcopy
+    body = target_doc.element.body
+    existing = list(body)
+    elements = [take(element) for element in source_doc.element.body
+                if element.tag != qn('w:sectPr')]
+    for offset, element in enumerate(elements):
+        body.insert(index + offset, element)
+
+    # Footnotes: copy each referenced footnote once under a fresh id
+    refs = [ref for element in elements for ref in element.iter(qn('w:footnoteReference'))]
+    copied_footnotes = []
+    if refs:
+        source_footnotes = _footnotes_by_id(source_doc.part.rels.part_with_reltype(RT.FOOTNOTES))[1]
+        target_part = target_doc.part.rels.part_with_reltype(RT.FOOTNOTES)
+        target_root, target_footnotes = _footnotes_by_id(target_part)
+        used_ids = [int(footnote_id) for footnote_id in target_footnotes if footnote_id.lstrip('-').isdigit()]
+        next_id = max(len(target_root), max(used_ids, default=0)) + 1
+        taken = set()
+        for ref in refs:
+            # A footnote referenced twice can only be moved once
+            source_id = ref.get(qn('w:id'))
+            source_footnote = source_footnotes[source_id]
+            footnote = deepcopy(source_footnote) if source_id in taken else take(source_footnote)
+            taken.add(source_id)
+            footnote.set(qn('w:id'), str(next_id))
+            ref.set(qn('w:id'), str(next_id))
+            target_root.append(footnote)
+            copied_footnotes.append(footnote)
+            next_id += 1
+
+    _add_styles(target_doc, source_doc, elements + copied_footnotes)
+    if copied_footnotes:
+        target_part._blob = serialize_part_xml(target_root)
+
+    # Keep bookmark and drawing ids unique within the target
+    bookmarks = _renumber(elements, qn('w:bookmarkStart'), qn('w:id'),
+                          _max_int_attribute(existing, qn('w:bookmarkStart'), qn('w:id')) + 1)
+    for element in elements:
+        for end in element.iter(qn('w:bookmarkEnd')):
+            if end.get(qn('w:id')) in bookmarks:
+                end.set(qn('w:id'), bookmarks[end.get(qn('w:id'))])
+    docpr_tag = f"{{{WP_NS}}}docPr"
+    header_parts = [rel.target_part for rel in target_doc.part.rels.values()
+                    if rel.reltype in (RT.HEADER, RT.FOOTER)]
+    used = max(_max_int_attribute(existing, docpr_tag, 'id'),
+               _max_int_attribute([part.element for part in header_parts], docpr_tag, 'id'))
+    _renumber(elements, docpr_tag, 'id', used + 1)
+
+def insert_document(target_doc, index, source_doc, consume=False):
+    """
+    Insert the body of source_doc into target_doc at body position index,
+    carrying its footnotes and styles across. Sources with content the direct
+    merge does not handle are composed with docxcompose instead.
+    With consume, the direct merge moves the source's elements rather than
+    copying them, so source_doc must not be used again afterwards.
+    Returns "direct" or "composer".
+    """
+    reason = unsupported_reason(target_doc, source_doc) if DIRECT_MERGE else "direct merge disabled"
+    if reason is None:
+        _merge_directly(target_doc, index, source_doc, consume)
+        method = "direct"
+    else:
+        log(f"Composing with docxcompose: {reason}", 'debug')
+        # Imported here: docxcompose is slow to import and rarely needed
+        from docxcompose.composer import Composer
+        Composer(target_doc).insert(index, source_doc)
+        method = "composer"
+    merge_counts[method] += 1
+    return method
+
+def append_document(target_doc, source_doc, consume=False):
+    """Append the body of source_doc to target_doc, before its final section properties"""
+    body = target_doc.element.body
+    sect_pr = body.find(qn('w:sectPr'))
+    index = len(body) if sect_pr is None else body.index(sect_pr)
+    return insert_document(target_doc, index, source_doc, consume)
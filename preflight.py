@@ -0,0 +1,92 @@
+import os
+import time
+from saa_common import LANGUAGE_CODES, output_filenames
+
+CONTENT_TYPES = ('Transcript', 'Translate')
+
+def list_docx(folder):
+    """Names of the .docx files in folder from one directory listing (empty if it does not exist)"""
+    try:
+        with os.scandir(folder) as entries:
+            return {entry.name for entry in entries if entry.name.lower().endswith('.docx')}
+    except OSError:
+        return set()
+
+def run_preflight(df, sources_dir, updated_dir=None, prefer_updated=False):
+    """
+    Check the workbook rows before any document is built, with one listing
+    of each source folder and column-wise operations over the sheet:
+
+    - missing_sources: (row, content type, filename) for sources that are not
+      in sources_dir (nor in updated_dir, when prefer_updated would use it)
+    - collisions: (output filename, rows) for outputs that two or more rows
+      map to, compared ignoring case as Windows and OneDrive do
+    - unmapped_languages: (row, language) for transcriptions whose language
+      has no code in LANGUAGE_CODES, so the filename would carry its name
+    - unmatched_updates: updated footnote files that no row uses (reported,
+      but they do not stop the build)
+
+    Returns a dict of those lists plus "seconds", the time the checks took.
+    """
+    import pandas as pd
+    start = time.perf_counter()
+    sources = list_docx(sources_dir)
+    updates = list_docx(updated_dir) if updated_dir else set()
+    available = sources | updates if prefer_updated else sources
+    outputs = output_filenames(df)
+
+    missing_sources = []
+    collisions = []
+    used = set()
+    for content_type in CONTENT_TYPES:
+        if content_type not in df:
+            continue
+        filled = df[content_type].notna()
+        names = df.loc[filled, content_type].map(str)
+        used.update(names)
+        missing = names[~names.isin(available)]
+        missing_sources.extend((idx, content_type, name) for idx, name in missing.items())
+
+        # Rows that would overwrite each other's output
+        output_names = outputs[content_type][filled]
+        keys = output_names.str.lower()
+        clashing = output_names[keys.duplicated(keep=False)]
+        for _, group in clashing.groupby(keys[clashing.index], sort=True):
+            collisions.append((group.iloc[-1], list(group.index)))
+
+    unmapped_languages = []
+    if 'Transcript' in df:
+        languages = df['Language'] if 'Language' in df else pd.Series(float('nan'), index=df.index)
+        transcribed = df['Transcript'].notna()
+        mapped = languages.map(str).str.lower().isin(list(LANGUAGE_CODES))
+        unmapped = languages[transcribed & ~mapped]
+        unmapped_languages = [(idx, language) for idx, language in unmapped.items()]
+
+    return {
+        "missing_sources": missing_sources,
+        "collisions": collisions,
+        "unmapped_languages": unmapped_languages,
+        "unmatched_updates": sorted(updates - used),
+        "seconds": time.perf_counter() - start,
+    }
+
+def preflight_passed(problems):
+    """Whether the build can go ahead (unmatched updated footnote files are only reported)"""
+    return not (problems["missing_sources"] or problems["collisions"] or problems["unmapped_languages"])
+
+def print_preflight(problems):
+    """Print the problems found by run_preflight"""
+    for idx, content_type, name in problems["missing_sources"]:
+        print(f"Missing {content_type} source for row {idx}: {name}")
+    for output, rows in problems["collisions"]:
+        print(f"Rows {', '.join(str(idx) for idx in rows)} all map to {output}")
+    for idx, language in problems["unmapped_languages"]:
+        print(f"Unmapped language for row {idx}: {language!r}")
+    if problems["unmatched_updates"]:
+        print(f"{len(problems['unmatched_updates'])} updated footnote files match no row:")
+        for name in problems["unmatched_updates"]:
+            print(f"- {name}")
+    print(f"Pre-flight checks: {len(problems['missing_sources'])} missing sources, "
+          f"{len(problems['collisions'])} filename collisions, "
+          f"{len(problems['unmapped_languages'])} unmapped languages "
+          f"({problems['seconds']:.2f}s)")
@@ -0,0 +1,153 @@
+import os
+import sys
+import json
+import time
+import datetime
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+class StageTimer:
+    """
+    Wall time per named stage of one document build, in milliseconds.
+    Stages that run more than once (e.g. one header update per section) add up.
+    """
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = 1000 * (time.perf_counter() - start)
+            self.stages[name] = self.stages.get(name, 0.0) + elapsed
+
+    @property
+    def total_ms(self):
+        return sum(self.stages.values())
+
+def reset_peak_rss():
+    """
+    Start a new peak RSS reading for this process. Only Linux can reset the
+    peak; elsewhere peak_rss_mb keeps reporting the peak since process start.
+    Returns whether the reading was reset.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB (see reset_peak_rss), or None where unavailable"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def summarize_records(records, slowest=10):
+    """
+    Aggregate per-document records into per-stage percentiles (ms) and a list
+    of the slowest documents
+    """
+    stage_times = {}
+    for record in records:
+        for stage, ms in record["stages"].items():
+            stage_times.setdefault(stage, []).append(ms)
+        stage_times.setdefault("total", []).append(record["total_ms"])
+
+    stages = {}
+    for stage, times in stage_times.items():
+        ordered = sorted(times)
+        stages[stage] = {
+            "count": len(ordered),
+            "mean_ms": sum(ordered) / len(ordered),
+            "p50_ms": percentile(ordered, 0.50),
+            "p90_ms": percentile(ordered, 0.90),
+            "p95_ms": percentile(ordered, 0.95),
+            "p99_ms": percentile(ordered, 0.99),
+            "max_ms": ordered[-1],
+        }
+
+    slowest_records = sorted(records, key=lambda record: record["total_ms"], reverse=True)[:slowest]
+    summary = {
+        "documents": len(records),
+        "stages": stages,
+        "slowest": [{key: record[key] for key in ("output", "source", "source_bytes", "total_ms")}
+                    for record in slowest_records],
+    }
+
+    # Peak RSS per document, where the platform reports it
+    peaks = sorted((record["peak_rss_mb"], record["output"]) for record in records
+                   if record.get("peak_rss_mb") is not None)
+    if peaks:
+        values = [peak for peak, _ in peaks]
+        summary["peak_rss_mb"] = {
+            "p50": percentile(values, 0.50),
+            "p95": percentile(values, 0.95),
+            "max": values[-1],
+            "max_output": peaks[-1][1],
+        }
+    return summary
+
+def write_run_report(path, records, **meta):
+    """
+    Write a JSONL run report: one "document" line per built document followed by
+    a single "summary" line with the per-stage percentiles. Returns the summary.
+    """
+    summary = summarize_records(records)
+    summary.update(meta)
+    summary["timestamp"] = datetime.datetime.now().isoformat(timespec='seconds')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(dict(record, type="document")) + "\n")
+        f.write(json.dumps(dict(summary, type="summary")) + "\n")
+    os.replace(temp_path, path)
+    return summary
+
+def read_run_report(path):
+    """Return the document records of a run report, or [] if it is missing or unreadable"""
+    records = []
+    try:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                record = json.loads(line)
+                if record.get("type") == "document":
+                    records.append(record)
+    except (OSError, ValueError):
+        return []
+    return records
+
+def print_stage_summary(summary):
+    """Print the per-stage percentiles of a run report summary"""
+    print(f"\n{'stage':<16}{'n':>6}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+    for stage, times in summary["stages"].items():
+        print(f"{stage:<16}{times['count']:>6}{times['mean_ms']:>10.1f}{times['p50_ms']:>10.1f}"
+              f"{times['p95_ms']:>10.1f}{times['max_ms']:>10.1f}")
+    if summary["slowest"]:
+        slowest = summary["slowest"][0]
+        print(f"Slowest document: {slowest['output']} ({slowest['total_ms']:.0f} ms, source {slowest['source']})")
+    if "peak_rss_mb" in summary:
+        peak = summary["peak_rss_mb"]
+        print(f"Peak RSS per document: p50 {peak['p50']:.0f} MB, p95 {peak['p95']:.0f} MB, "
+              f"max {peak['max']:.0f} MB ({peak['max_output']})")
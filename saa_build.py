@@ -0,0 +1,162 @@
+import os
+import sys
+import time
+import argparse
+from saa_common import LOG_LEVELS, set_log_level, load_script
+from write_behind import WRITE_QUEUE_DEPTH
+from watch import POLL_INTERVAL
+
+# The pipeline in one process. Only the light modules above are imported at
+# startup; pandas, openpyxl and python-docx come in with the first subcommand
+# that needs them, so --help and the pre-flight checks start quickly, and
+# "all" pays for the imports and the workbook load once instead of per step.
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+def load(refresh=False):
+    """Step 1; returns the workbook rows, or None if the workbook could not be read"""
+    from saa_common import excel_file, data_store_file, load_merge_data
+    try:
+        df, from_cache = load_merge_data(refresh=refresh)
+    except Exception as e:
+        print(f"Error loading Excel file: {e}")
+        return None
+    print(f"Loaded {len(df)} rows from {data_store_file if from_cache else excel_file}")
+    return df
+
+def check(prefer_updated=False):
+    """Run the pre-flight checks without importing the document libraries"""
+    from preflight import run_preflight, preflight_passed, print_preflight
+    df = load()
+    if df is None:
+        return 1
+    data_folder = os.path.join(current_dir, 'data')
+    problems = run_preflight(df, os.path.join(data_folder, 'transcriptions-translations'),
+                             os.path.join(data_folder, 'DBL-UpdatedFootnotes'), prefer_updated)
+    print_preflight(problems)
+    return 0 if preflight_passed(problems) else 1
+
+def build_options(args):
+    """Keyword arguments for the step 2 main from the parsed build options"""
+    return {
+        "workers": args.workers,
+        "write_queue": args.write_queue,
+        "memory_budget": args.memory_budget,
+        "prefer_updated": args.prefer_updated,
+        "preflight": not args.skip_preflight,
+    }
+
+def run_command(args):
+    """Run a parsed subcommand; returns the process exit status"""
+    if args.command == 'load':
+        return 0 if load(refresh=args.refresh) is not None else 1
+    if args.command == 'check':
+        return check(prefer_updated=args.prefer_updated)
+    if args.command == 'watch':
+        from watch import watch
+        watch(interval=args.interval, prefer_updated=args.prefer_updated)
+        return 0
+    if args.command == 'merge':
+        load_script('merge_good_format').main(snapshot=args.snapshot, bundle=args.bundle, workers=args.workers)
+        return 0
+
+    df = load()
+    if df is None:
+        return 1
+    build = load_script('build_document_and_header')
+    if args.command == 'restamp':
+        return build.main(workers=args.workers, restamp=True, prefer_updated=args.prefer_updated, df=df) or 0
+    if args.command == 'build':
+        options = build_options(args)
+        if args.report is not None:
+            options["report"] = args.report
+        return build.main(force=args.force, bundle=args.bundle, df=df, **options) or 0
+
+    # all: build, then merge the updated footnote files, on the rows loaded above
+    status = build.main(df=df, **build_options(args))
+    if status:
+        return status
+    if not args.prefer_updated:
+        # With --prefer-updated the build already made the merged documents
+        from saa_common import prepare_rows
+        print()
+        load_script('merge_good_format').main(workers=args.workers, rows=prepare_rows(df))
+    return 0
+
+def add_build_arguments(parser):
+    """Options shared by the build and all subcommands (see 02_build_document_and_header.py)"""
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of worker processes (1 = serial, 0 = one per CPU core)")
+    parser.add_argument("--write-queue", type=int, default=WRITE_QUEUE_DEPTH,
+                        help=f"Finished documents that may wait for the background writer (default: {WRITE_QUEUE_DEPTH})")
+    parser.add_argument("--memory-budget", type=int, default=None, metavar="MB",
+                        help="Only run as many documents at once as fit in this many MB of worker memory")
+    parser.add_argument("--prefer-updated", action="store_true",
+                        help="Build from the DBL-UpdatedFootnotes version of a source where there is one")
+    parser.add_argument("--skip-preflight", action="store_true",
+                        help="Build even if the pre-flight checks find problems")
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        prog="saa_build.py",
+        description="Run the SAA document pipeline, or any step of it, in a single process")
+    parser.add_argument("--log-level", choices=list(LOG_LEVELS), default=None,
+                        help="Console verbosity; 'debug' prints every document (default: info)")
+    subparsers = parser.add_subparsers(dest="command", required=True, metavar="command")
+
+    load_parser = subparsers.add_parser("load", help="Step 1: load the workbook into the data store")
+    load_parser.add_argument("--refresh", action="store_true",
+                             help="Re-read the workbook even if it has not changed")
+
+    check_parser = subparsers.add_parser("check", help="Check the sheet against the source folders")
+    check_parser.add_argument("--prefer-updated", action="store_true",
+                              help="Count sources that only exist in DBL-UpdatedFootnotes as present")
+
+    build_parser = subparsers.add_parser("build", help="Step 2: build the documents whose inputs changed")
+    add_build_arguments(build_parser)
+    build_parser.add_argument("--force", action="store_true",
+                              help="Rebuild every document, even if its inputs have not changed")
+    build_parser.add_argument("--bundle", default=None,
+                              help="Build every document into this .zip or .tar archive instead")
+    build_parser.add_argument("--report", default=None,
+                              help="JSONL run report with per-stage timings (default: temp/build_report.jsonl, "
+                                   "empty string to disable)")
+
+    restamp_parser = subparsers.add_parser("restamp",
+                                           help="Update the citation, metadata and header fields in place")
+    restamp_parser.add_argument("--workers", type=int, default=1,
+                                help="Number of worker processes (1 = serial, 0 = one per CPU core)")
+    restamp_parser.add_argument("--prefer-updated", action="store_true",
+                                help="Restamp the documents a --prefer-updated build made from updated footnote files")
+
+    merge_parser = subparsers.add_parser("merge", help="Step 3: merge the updated footnote files")
+    output = merge_parser.add_mutually_exclusive_group()
+    output.add_argument("--snapshot", action="store_true",
+                        help="Also hard-link the merged outputs into a dated generated_docs_updated_YYYYMMDD directory")
+    output.add_argument("--bundle", default=None,
+                        help="Merge every matched document into this .zip or .tar archive instead")
+    merge_parser.add_argument("--workers", type=int, default=1,
+                              help="Number of worker processes (1 = serial, 0 = one per CPU core)")
+
+    all_parser = subparsers.add_parser("all", help="Load, build and merge, sharing the loaded rows")
+    add_build_arguments(all_parser)
+
+    watch_parser = subparsers.add_parser("watch", help="Rebuild affected documents as the inputs change")
+    watch_parser.add_argument("--interval", type=float, default=POLL_INTERVAL,
+                              help=f"Seconds between checks for changes (default: {POLL_INTERVAL})")
+    watch_parser.add_argument("--prefer-updated", action="store_true",
+                              help="Build from the DBL-UpdatedFootnotes version of a source where there is one")
+    return parser
+
+def main(argv=None):
+    args = make_parser().parse_args(argv)
+    if args.log_level:
+        set_log_level(args.log_level)
+    start = time.perf_counter()
+    status = run_command(args)
+    if args.command == 'all':
+        print(f"\nPipeline finished in {time.perf_counter() - start:.1f}s")
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
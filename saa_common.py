@@ -0,0 +1,283 @@
+import os
+import re
+import sys
+import json
+import hashlib
+import importlib.util
+
+# Define paths
+current_dir = os.path.dirname(os.path.abspath(__file__))
+excel_file = os.path.join(current_dir, 'data', 'SAA-DBL-MergeData.xlsx')
+# Cached copy of the workbook rows, and the workbook hash it was built from
+data_store_file = os.path.join(current_dir, 'temp', 'processed_data.pkl')
+data_store_meta_file = os.path.join(current_dir, 'temp', 'processed_data.json')
+# Source document -> generated outputs, written by the build and read by the merge
+source_index_file = os.path.join(current_dir, 'temp', 'source_index.json')
+# Inputs of each generated document, written by the build; the merge reads which
+# documents the build made from updated footnote files itself
+manifest_file = os.path.join(current_dir, 'temp', 'build_manifest.json')
+
+# Workbook columns used by the pipeline (matched ignoring surrounding spaces)
+PIPELINE_COLUMNS = [
+    'Digital ID', 'Sender', 'Sender Place', 'Receiver', 'Receiver Place', 'Date',
+    'Filename', 'Transcript', 'Translate', 'Language', 'DBL - Doc number',
+    'Transcript range', 'Translate range', 'volume'
+]
+
+# Numbered pipeline scripts by the module name they are imported under
+# (their file names are not valid module names)
+SCRIPTS = {
+    'build_document_and_header': '02_build_document_and_header.py',
+    'merge_good_format': '03_merge_good_format.py',
+}
+
+def load_script(name):
+    """
+    Import a pipeline script from SCRIPTS once per process. It is registered
+    in sys.modules under name, so functions pickled from it resolve.
+    """
+    if name not in sys.modules:
+        spec = importlib.util.spec_from_file_location(name, os.path.join(current_dir, SCRIPTS[name]))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        try:
+            spec.loader.exec_module(module)
+        except BaseException:
+            del sys.modules[name]
+            raise
+    return sys.modules[name]
+
+def process_pool(workers, module_name):
+    """
+    ProcessPoolExecutor with workers processes (0 = one per CPU core) for
+    functions of module_name. Workers started with spawn (the default on
+    Windows and macOS) re-import modules by name, so a script imported with
+    load_script is loaded the same way in each worker before any job arrives.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    if module_name in SCRIPTS:
+        return ProcessPoolExecutor(max_workers=workers or None, initializer=load_script, initargs=(module_name,))
+    return ProcessPoolExecutor(max_workers=workers or None)
+
+# Console verbosity, from the SAA_LOG_LEVEL environment variable (default "info").
+# Per-document detail is logged at "debug" and skipped unless asked for.
+LOG_LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40}
+_log_level = LOG_LEVELS.get(os.environ.get('SAA_LOG_LEVEL', 'info').lower(), LOG_LEVELS['info'])
+
+def set_log_level(name):
+    """Set the console log level for this process and any worker processes it starts"""
+    global _log_level
+    _log_level = LOG_LEVELS[name]
+    os.environ['SAA_LOG_LEVEL'] = name
+
+def log_enabled(level):
+    """Whether messages at level are printed"""
+    return LOG_LEVELS[level] >= _log_level
+
+def log(message, level='info'):
+    """Print message if level is at or above the configured log level"""
+    if LOG_LEVELS[level] >= _log_level:
+        print(message)
+
+# File hashes computed during this run, keyed by (path, mtime, size)
+_file_hash_cache = {}
+
+def file_hash(path):
+    """Return the SHA-256 hex digest of a file, or 'missing' if it does not exist"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return 'missing'
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    if key not in _file_hash_cache:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        _file_hash_cache[key] = digest.hexdigest()
+    return _file_hash_cache[key]
+
+def load_json_file(path):
+    """Load a JSON state file, returning an empty dict if it is missing or unreadable"""
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable state file {path}: {e}")
+        return {}
+
+def save_json_file(path, data):
+    """Write a JSON state file atomically"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    os.replace(temp_path, path)
+
+def read_workbook(path=excel_file):
+    """Parse the workbook with openpyxl, keeping only the columns the pipeline uses"""
+    import pandas as pd
+    df = pd.read_excel(path)
+    keep = [column for column in df.columns if str(column).strip() in PIPELINE_COLUMNS]
+    return df[keep]
+
+def load_merge_data(path=excel_file, refresh=False):
+    """
+    Return the workbook rows as a DataFrame. The rows are cached in the temp
+    store together with the workbook's hash, so the workbook is only parsed
+    again when its content changes (or when refresh is set).
+    Returns (df, from_cache).
+    """
+    import pandas as pd
+    workbook_hash = file_hash(path)
+    meta = load_json_file(data_store_meta_file)
+    if (not refresh and meta.get("workbook_hash") == workbook_hash
+            and os.path.exists(data_store_file)):
+        try:
+            return pd.read_pickle(data_store_file), True
+        except Exception as e:
+            print(f"Ignoring unreadable data store {data_store_file}: {e}")
+
+    df = read_workbook(path)
+    os.makedirs(os.path.dirname(data_store_file), exist_ok=True)
+    temp_path = data_store_file + ".tmp"
+    df.to_pickle(temp_path)
+    os.replace(temp_path, data_store_file)
+    save_json_file(data_store_meta_file, {
+        "workbook": os.path.basename(path),
+        "workbook_hash": workbook_hash,
+        "rows": len(df),
+        "columns": [str(column) for column in df.columns],
+    })
+    return df, False
+
+# Language names (lowercase) and the codes used for them in output filenames.
+# Other languages keep their name; translations are always EN.
+LANGUAGE_CODES = {
+    'german/dutch': 'DE-NL',
+    'french; german': 'FR-DE',
+    'german': 'DE',
+    'dutch': 'NL',
+    'french': 'FR',
+}
+
+# Precomputed fields added to each record by prepare_rows
+PREPARED_OUTPUT = {'Transcript': '_output_transcript', 'Translate': '_output_translate'}
+
+def get_lang_code(language, content_type):
+    """Language code for an output filename ('Transcript'/'Translate', any case)"""
+    if content_type.lower() == 'translate':
+        return 'EN'
+    return LANGUAGE_CODES.get(str(language).lower(), str(language))
+
+def output_filename(filename, language_code, content_type):
+    """Build the sanitized output filename shared by the build and merge steps"""
+    safe_filename = f"{filename}_{language_code}_{content_type.lower()}.docx"
+    # Remove characters that are not valid in filenames, then replace spaces
+    safe_filename = re.sub(r'[<>:"/\\|?*]', '', safe_filename)
+    return safe_filename.replace(" ", "_")
+
+def output_filenames(df):
+    """
+    Output filenames of every row for each content type, computed for the
+    whole sheet at once with the same rules as output_filename.
+    Returns {'Transcript': Series, 'Translate': Series} indexed like df.
+    """
+    import pandas as pd
+    blank = pd.Series('', index=df.index)
+    filenames = df['Filename'].map(str) if 'Filename' in df else blank
+    languages = df['Language'].map(str) if 'Language' in df else blank
+    transcript_codes = languages.str.lower().map(LANGUAGE_CODES).fillna(languages)
+
+    outputs = {}
+    for content_type, codes in (('Transcript', transcript_codes), ('Translate', 'EN')):
+        names = filenames + '_' + codes + f'_{content_type.lower()}.docx'
+        outputs[content_type] = (names.str.replace(r'[<>:"/\\|?*]', '', regex=True)
+                                 .str.replace(' ', '_', regex=False))
+    return outputs
+
+def prepare_rows(df):
+    """
+    Turn the workbook rows into plain (index, record) pairs for the pipeline.
+    Each record holds the row's columns (empty cells stay NaN) plus the output
+    filename for each content type (see output_filenames).
+    """
+    outputs = output_filenames(df)
+    records = df.to_dict('records')
+    for record, transcript, translate in zip(records, outputs['Transcript'], outputs['Translate']):
+        record[PREPARED_OUTPUT['Transcript']] = transcript
+        record[PREPARED_OUTPUT['Translate']] = translate
+    return list(zip(df.index, records))
+
+def index_sources(outputs):
+    """
+    Invert {output filename: (content type, source filename)} into the source
+    index: {source filename: [{"output": ..., "content_type": ...}, ...]}
+    """
+    index = {}
+    for output, (content_type, source) in outputs.items():
+        index.setdefault(source, []).append({"output": output, "content_type": content_type})
+    return index
+
+def index_records(records):
+    """Source index for prepare_rows records (the last row wins for a shared output, as in the build)"""
+    import pandas as pd
+    outputs = {}
+    for _, record in records:
+        for content_type in ('Transcript', 'Translate'):
+            if not pd.isna(record.get(content_type, pd.NA)):
+                outputs[record[PREPARED_OUTPUT[content_type]]] = (content_type, str(record[content_type]))
+    return index_sources(outputs)
+
+class SheetRow:
+    """
+    Lightweight spreadsheet row from the streaming reader. Supports row[column]
+    and row.get(column, default) like the pandas Series rows, with empty cells
+    read as NaN as pandas does. Cells keep the type openpyxl gives them rather
+    than a whole-column dtype.
+    """
+    __slots__ = ('columns', 'values')
+
+    def __init__(self, columns, values):
+        self.columns = columns
+        self.values = values
+
+    def __getitem__(self, column):
+        return self.values[self.columns[column]]
+
+    def __contains__(self, column):
+        return column in self.columns
+
+    def get(self, column, default=None):
+        position = self.columns.get(column)
+        return default if position is None else self.values[position]
+
+def stream_workbook_rows(path=excel_file):
+    """
+    Yield (row index, SheetRow) pairs from the first worksheet using openpyxl's
+    read-only mode, so rows can be processed while the rest of the sheet is
+    still being read. Fully empty rows are skipped; a missing Filename,
+    Transcript or Translate column raises ValueError.
+    """
+    from openpyxl import load_workbook
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        sheet_rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(sheet_rows, ())
+        positions = [i for i, name in enumerate(header)
+                     if name is not None and str(name).strip() in PIPELINE_COLUMNS]
+        columns = {header[i]: n for n, i in enumerate(positions)}
+        missing = [name for name in ('Filename', 'Transcript', 'Translate') if name not in columns]
+        if missing:
+            raise ValueError(f"Workbook {path} is missing columns: {', '.join(missing)}")
+
+        for idx, values in enumerate(sheet_rows):
+            if all(value is None for value in values):
+                continue
+            yield idx, SheetRow(columns, tuple(
+                float('nan') if i >= len(values) or values[i] is None else values[i]
+                for i in positions))
+    finally:
+        workbook.close()
@@ -0,0 +1,110 @@
+import os
+import zipfile
+from collections import OrderedDict
+from docx import Document
+from saa_common import file_hash
+
+# Memory bound for parsed source documents (uncompressed package bytes),
+# configurable through the SAA_SOURCE_CACHE_MB environment variable (0 turns caching off)
+SOURCE_CACHE_MAX_BYTES = int(os.environ.get("SAA_SOURCE_CACHE_MB", "256")) * 1024 * 1024
+
+class SourceCache:
+    """
+    LRU cache of parsed source documents from data/transcriptions-translations
+    and DBL-UpdatedFootnotes, shared by the build and merge steps.
+
+    Entries are weighted by the uncompressed size of their package and the least
+    recently used ones are evicted once max_bytes is exceeded. On every lookup an
+    entry is revalidated against the file's mtime and size; if those changed, it
+    is re-parsed only when the content hash changed as well.
+
+    Cached documents are passed straight to Composer, which copies their body
+    elements and only reads the source package, so one parse can serve any
+    number of compositions.
+
+    With max_bytes set to 0 nothing is cached: every lookup parses the file
+    and the caller owns the result, so its elements can be moved into the
+    target instead of copied (see footnote_merge.insert_document's consume).
+    """
+    def __init__(self, max_bytes=SOURCE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def get(self, path):
+        """Return the parsed document for path, loading it on a miss"""
+        if not self.enabled:
+            self.misses += 1
+            return Document(path)
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        stat_key = (stat.st_mtime_ns, stat.st_size)
+        entry = self._entries.get(path)
+
+        if entry is not None and entry["stat"] != stat_key:
+            # Touched or rewritten: keep the parse only if the content is the same
+            if entry["hash"] == file_hash(path):
+                entry["stat"] = stat_key
+            else:
+                self.invalidate(path)
+                entry = None
+
+        if entry is not None:
+            self.hits += 1
+            self._entries.move_to_end(path)
+            return entry["document"]
+
+        self.misses += 1
+        with zipfile.ZipFile(path) as package:
+            weight = sum(info.file_size for info in package.infolist())
+        entry = {
+            "stat": stat_key,
+            "hash": file_hash(path),
+            "weight": weight,
+            "document": Document(path),
+        }
+        self._entries[path] = entry
+        self.total_bytes += weight
+        self._evict()
+        return entry["document"]
+
+    def invalidate(self, path=None):
+        """Drop one cached document, or all of them if no path is given"""
+        if path is None:
+            self._entries.clear()
+            self.total_bytes = 0
+            return
+        entry = self._entries.pop(os.path.abspath(path), None)
+        if entry is not None:
+            self.total_bytes -= entry["weight"]
+
+    def _evict(self):
+        """Evict least recently used documents until the cache fits its bound"""
+        # Always keep the most recent entry, even if it alone exceeds the bound
+        while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+            _, entry = self._entries.popitem(last=False)
+            self.total_bytes -= entry["weight"]
+
+    def __len__(self):
+        return len(self._entries)
+
+# Process-wide cache used by the pipeline steps
+source_cache = SourceCache()
+
+def set_source_cache_mb(megabytes):
+    """Set the source cache bound for this process and any worker processes it starts (0 = no caching)"""
+    source_cache.max_bytes = megabytes * 1024 * 1024
+    source_cache._evict()
+    if not source_cache.enabled:
+        source_cache.invalidate()
+    os.environ["SAA_SOURCE_CACHE_MB"] = str(megabytes)
+
+def load_source_document(path):
+    """Load a source document through the shared cache"""
+    return source_cache.get(path)
@@ -0,0 +1,77 @@
+import os
+import shutil
+import zipfile
+import pytest
+from saa_common import load_merge_data, prepare_rows, PREPARED_OUTPUT
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sources_dir = os.path.join(current_dir, "data", "transcriptions-translations")
+
+def copy_sources(build, tmp_path, rows):
+    """Point the build's data folder at tmp_path, with copies of the sources the rows use"""
+    build.data_folder = str(tmp_path / "data")
+    os.makedirs(os.path.join(build.data_folder, "transcriptions-translations"))
+    for _, row in rows:
+        for content_type in ('Transcript', 'Translate'):
+            shutil.copy(os.path.join(sources_dir, row[content_type]),
+                        os.path.join(build.data_folder, "transcriptions-translations", row[content_type]))
+
+def built(results):
+    return sorted(os.path.basename(result["path"]) for result in results if result["path"])
+
+@pytest.mark.usefixtures("tmp_folders")
+def test_manifest_skips_unchanged_documents_and_removes_orphans(tmp_path, build):
+    """Only documents whose inputs changed are rebuilt, and documents of removed rows are deleted"""
+    df, _ = load_merge_data()
+    rows = prepare_rows(df.head(3))
+    copy_sources(build, tmp_path, rows)
+    outputs = sorted(row[PREPARED_OUTPUT[content_type]] for _, row in rows
+                     for content_type in ('Transcript', 'Translate'))
+
+    results, skipped, _ = build.build_documents(rows)
+    assert built(results) == outputs and skipped == 0
+    assert sorted(os.listdir(build.OUTPUT_DIR)) == outputs
+
+    # Nothing changed: every document is skipped
+    results, skipped, _ = build.build_documents(rows)
+    assert results == [] and skipped == len(outputs)
+
+    # A changed source rebuilds only the document built from it
+    row = rows[1][1]
+    changed_source = os.path.join(build.data_folder, "transcriptions-translations", row['Translate'])
+    shutil.copy(os.path.join(sources_dir, rows[0][1]['Translate']), changed_source)
+    results, skipped, _ = build.build_documents(rows)
+    assert built(results) == [row[PREPARED_OUTPUT['Translate']]]
+    assert skipped == len(outputs) - 1
+
+    # A row removed from the sheet takes exactly its outputs with it
+    removed = rows[2][1]
+    results, skipped, _ = build.build_documents(rows[:2])
+    assert results == [] and skipped == len(outputs) - 2
+    assert sorted(os.listdir(build.OUTPUT_DIR)) == sorted(
+        output for output in outputs
+        if output not in (removed[PREPARED_OUTPUT['Transcript']], removed[PREPARED_OUTPUT['Translate']]))
+
+def package_members(path):
+    """Content of every member of a .docx (the archive timestamps differ between builds)"""
+    with zipfile.ZipFile(path) as package:
+        return {name: package.read(name) for name in package.namelist()}
+
+@pytest.mark.usefixtures("tmp_folders")
+def test_parallel_build_matches_serial(tmp_path, build):
+    """Worker processes build the same documents, in the same result order, as a serial build"""
+    df, _ = load_merge_data()
+    rows = prepare_rows(df.head(4))
+    copy_sources(build, tmp_path, rows)
+    results = {}
+    for workers in (1, 2):
+        build.OUTPUT_DIR = str(tmp_path / f"workers{workers}")
+        os.makedirs(build.OUTPUT_DIR)
+        results[workers], _, _ = build.build_documents(rows, workers=workers, force=True)
+
+    assert [(r["row"], r["content_type"], r["error"]) for r in results[1]] == \
+        [(r["row"], r["content_type"], r["error"]) for r in results[2]]
+    names = sorted(os.listdir(tmp_path / "workers1"))
+    assert names == sorted(os.listdir(tmp_path / "workers2")) and len(names) == 8
+    for name in names:
+        assert package_members(tmp_path / "workers1" / name) == package_members(tmp_path / "workers2" / name)
@@ -0,0 +1,41 @@
+import json
+import hashlib
+import tarfile
+import zipfile
+import pytest
+from bundle import DocumentBundle, MANIFEST_NAME
+
+@pytest.mark.parametrize("name", ["out.zip", "out.tar", "out.tar.gz"])
+def test_bundle_holds_documents_and_manifest(tmp_path, name):
+    """Documents are stored under their base names and listed in the manifest"""
+    path = str(tmp_path / name)
+    bundle = DocumentBundle(path)
+    bundle.add("/somewhere/a.docx", b"first")
+    bundle.add("b.docx", b"second")
+    assert not (tmp_path / name).exists()
+    bundle.close(step="build")
+
+    if name.endswith(".zip"):
+        with zipfile.ZipFile(path) as archive:
+            members = {member: archive.read(member) for member in archive.namelist()}
+    else:
+        with tarfile.open(path) as archive:
+            members = {member: archive.extractfile(member).read() for member in archive.getnames()}
+
+    manifest = json.loads(members.pop(MANIFEST_NAME))
+    assert members == {"a.docx": b"first", "b.docx": b"second"}
+    assert manifest["step"] == "build"
+    assert [(d["name"], d["bytes"], d["sha256"]) for d in manifest["documents"]] == [
+        ("a.docx", 5, hashlib.sha256(b"first").hexdigest()),
+        ("b.docx", 6, hashlib.sha256(b"second").hexdigest()),
+    ]
+
+def test_aborted_bundle_leaves_nothing(tmp_path):
+    bundle = DocumentBundle(str(tmp_path / "out.zip"))
+    bundle.add("a.docx", b"first")
+    bundle.abort()
+    assert list(tmp_path.iterdir()) == []
+
+def test_unknown_format_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        DocumentBundle(str(tmp_path / "out.rar"))
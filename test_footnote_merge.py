@@ -0,0 +1,73 @@
+import os
+from copy import deepcopy
+from docx import Document
+from docx.oxml import parse_xml
+from docx.oxml.ns import qn
+import footnote_merge
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+template_file = os.path.join(current_dir, "data", "SAA-DBL-TranscriptionTemplate.docx")
+source_file = os.path.join(current_dir, "data", "transcriptions-translations", "565.A_1196_04-06-1672-Eng.docx")
+
+def merged(source, direct):
+    """Append source to a fresh template with the direct merge switched on or off"""
+    doc = Document(template_file)
+    footnote_merge.DIRECT_MERGE = direct
+    try:
+        method = footnote_merge.append_document(doc, source)
+    finally:
+        footnote_merge.DIRECT_MERGE = True
+    return doc, method
+
+def referenced_footnotes(doc):
+    """Return the text of each footnote in the order the body references it"""
+    part = doc.part.rels.part_with_reltype(footnote_merge.RT.FOOTNOTES)
+    footnotes = parse_xml(part.blob)
+    texts = {footnote.get(qn("w:id")): "".join(footnote.itertext())
+             for footnote in footnotes.iter(qn("w:footnote"))}
+    return [texts[ref.get(qn("w:id"))] for ref in doc.element.body.iter(qn("w:footnoteReference"))]
+
+def test_direct_merge_matches_composer():
+    """The direct merge carries the same text, footnotes and styles as docxcompose"""
+    source = Document(source_file)
+    direct, method = merged(source, True)
+    composed, _ = merged(source, False)
+    assert method == "direct"
+
+    assert [p.text for p in direct.paragraphs] == [p.text for p in composed.paragraphs]
+    assert referenced_footnotes(direct) == referenced_footnotes(composed)
+    assert len(referenced_footnotes(direct)) > 0
+
+    # Every style the merged body uses is defined in the target
+    style_ids = {style.style_id for style in direct.styles}
+    for tag in ("w:pStyle", "w:rStyle"):
+        for ref in direct.element.body.iter(qn(tag)):
+            assert ref.get(qn("w:val")) in style_ids
+
+    # Bookmark ids stay unique
+    ids = [b.get(qn("w:id")) for b in direct.element.body.iter(qn("w:bookmarkStart"))]
+    assert len(ids) == len(set(ids))
+
+def test_unsupported_source_falls_back_to_composer():
+    """Sources with more than one section are left to docxcompose"""
+    source = Document(source_file)
+    para = deepcopy(source.paragraphs[0]._p)
+    para.get_or_add_pPr().append(deepcopy(source.element.body.sectPr))
+    source.element.body.insert(0, para)
+
+    assert footnote_merge.unsupported_reason(Document(template_file), source) == "multiple sections"
+    _, method = merged(source, True)
+    assert method == "composer"
+
+def test_consuming_merge_matches_copying_merge():
+    """Moving the source's elements gives the same document as copying them"""
+    copied = Document(template_file)
+    footnote_merge.append_document(copied, Document(source_file))
+    moved = Document(template_file)
+    source = Document(source_file)
+    assert footnote_merge.append_document(moved, source, consume=True) == "direct"
+
+    assert moved.element.xml == copied.element.xml
+    assert referenced_footnotes(moved) == referenced_footnotes(copied)
+    # The source body was emptied rather than copied
+    assert [element.tag for element in source.element.body] == [qn("w:sectPr")]
@@ -0,0 +1,52 @@
+import os
+import shutil
+from saa_common import save_json_file
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sources_dir = os.path.join(current_dir, "data", "transcriptions-translations")
+
+# Generated document, the source used as its updated footnote file, and its content type
+PAIRS = [
+    ("565.A_1196_01_NL_transcript.docx", "565.A_1196_04-06-1672-Dut.docx", "Transcript"),
+    ("565.A_1196_01_EN_translate.docx", "565.A_1196_04-06-1672-Eng.docx", "Translate"),
+]
+
+def test_ledger_skips_unchanged_pairs_and_removes_orphans(tmp_path, merge, capsys):
+    """A second run merges nothing, and a removed footnote file takes only its merged output with it"""
+    merge.footnotes_dir = str(tmp_path / "footnotes")
+    merge.output_dir = str(tmp_path / "updated")
+    merge.ledger_path = str(tmp_path / "merge_ledger.json")
+    merge.source_index_file = str(tmp_path / "source_index.json")
+    os.makedirs(merge.footnotes_dir)
+    for _, source, _ in PAIRS:
+        shutil.copy(os.path.join(sources_dir, source), merge.footnotes_dir)
+    save_json_file(merge.source_index_file, {
+        source: [{"output": output, "content_type": content_type}] for output, source, content_type in PAIRS
+    })
+
+    merge.main()
+    assert "Merged 2 of 2 documents" in capsys.readouterr().out
+    assert sorted(os.listdir(merge.output_dir)) == sorted(output for output, _, _ in PAIRS)
+    mtimes = {name: os.stat(os.path.join(merge.output_dir, name)).st_mtime_ns for name in os.listdir(merge.output_dir)}
+
+    merge.main()
+    out = capsys.readouterr().out
+    assert "Merged 0 of 0 documents" in out and "Skipped 2 unchanged documents" in out
+    assert {name: os.stat(os.path.join(merge.output_dir, name)).st_mtime_ns
+            for name in os.listdir(merge.output_dir)} == mtimes
+
+    os.remove(os.path.join(merge.footnotes_dir, PAIRS[1][1]))
+    merge.main()
+    out = capsys.readouterr().out
+    assert f"Removed orphaned merged document: {PAIRS[1][0]}" in out
+    assert "Skipped 1 unchanged documents" in out
+    assert os.listdir(merge.output_dir) == [PAIRS[0][0]]
+
+def test_missing_footnote_folder_skips_the_merge(tmp_path, merge, capsys):
+    """Without data/DBL-UpdatedFootnotes (the repo does not ship it) the merge step is skipped, not crashed"""
+    merge.footnotes_dir = str(tmp_path / "footnotes")
+    merge.output_dir = str(tmp_path / "updated")
+    merge.ledger_path = str(tmp_path / "merge_ledger.json")
+    merge.main()
+    assert "nothing to merge" in capsys.readouterr().out
+    assert not os.path.exists(merge.output_dir) and not os.path.exists(merge.ledger_path)
@@ -0,0 +1,134 @@
+import os
+import shutil
+import pytest
+from docx import Document
+from docx.oxml import parse_xml
+from docx.oxml.ns import qn
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from saa_common import load_merge_data, prepare_rows, PREPARED_OUTPUT, file_hash, load_json_file
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sources_dir = os.path.join(current_dir, "data", "transcriptions-translations")
+# Stands in for the updated footnote version of the row's source
+updated_source = os.path.join(sources_dir, "565.A_1196_04-06-1672-Dut.docx")
+
+def paragraph_texts(path):
+    return [para.text for para in Document(path).paragraphs]
+
+def referenced_footnotes(path):
+    """Return the text of each footnote in the order the body references it"""
+    doc = Document(path)
+    footnotes = parse_xml(doc.part.rels.part_with_reltype(RT.FOOTNOTES).blob)
+    texts = {footnote.get(qn("w:id")): "".join(footnote.itertext())
+             for footnote in footnotes.iter(qn("w:footnote"))}
+    return [texts[ref.get(qn("w:id"))] for ref in doc.element.body.iter(qn("w:footnoteReference"))]
+
+@pytest.mark.usefixtures("tmp_folders")
+def test_fused_build_matches_build_then_merge(tmp_path, build, merge):
+    """Building from the updated footnote file gives what step 3 makes of the step 2 document"""
+    df, _ = load_merge_data()
+    row = df.iloc[0]
+    shutil.copy(updated_source, os.path.join(build.updated_folder, row['Transcript']))
+
+    # Step 2, then step 3 on a copy
+    generated = build.create_document(row, 'Transcript')
+    merged = str(tmp_path / "merged.docx")
+    shutil.copy(generated, merged)
+    assert merge.replace_section_with_footnotes(merged, updated_source, "Transcription:")
+
+    fused = build.create_document(row, 'Transcript', prefer_updated=True)
+    assert os.path.dirname(fused) == build.UPDATED_DIR
+    assert os.path.basename(fused) == os.path.basename(generated)
+    assert paragraph_texts(fused) == paragraph_texts(merged)
+    assert referenced_footnotes(fused) == referenced_footnotes(merged)
+    assert paragraph_texts(fused) != paragraph_texts(generated)
+
+    # Without an updated file the original source is used
+    os.remove(os.path.join(build.updated_folder, row['Transcript']))
+    assert build.create_document(row, 'Transcript', prefer_updated=True) == generated
+
+@pytest.mark.usefixtures("tmp_folders")
+def test_document_leaves_updated_dir_when_its_updated_file_goes_away(build):
+    """Deleting an updated footnote file moves its document back to OUTPUT_DIR, leaving no stale copy"""
+    df, _ = load_merge_data()
+    rows = prepare_rows(df.head(1))
+    row = rows[0][1]
+    updated_file = os.path.join(build.updated_folder, row['Transcript'])
+    shutil.copy(updated_source, updated_file)
+    output = row[PREPARED_OUTPUT['Transcript']]
+
+    build.build_documents(rows, prefer_updated=True)
+    assert os.listdir(build.UPDATED_DIR) == [output]
+    assert output not in os.listdir(build.OUTPUT_DIR)
+
+    os.remove(updated_file)
+    results, skipped, _ = build.build_documents(rows, prefer_updated=True)
+    assert [os.path.basename(result["path"]) for result in results] == [output]
+    assert os.listdir(build.UPDATED_DIR) == []
+    assert output in os.listdir(build.OUTPUT_DIR)
+
+@pytest.mark.usefixtures("tmp_folders")
+def test_memory_estimate_and_report_use_the_updated_file(tmp_path, build):
+    """With prefer_updated, the memory estimate and the run report describe the updated footnote file"""
+    df, _ = load_merge_data()
+    rows = prepare_rows(df.head(1))
+    idx, row = rows[0]
+    shutil.copy(updated_source, os.path.join(build.updated_folder, row['Transcript']))
+    job = (idx, row, 'Transcript')
+    budget = build.MemoryBudget(10000, str(tmp_path / "no-report.jsonl"))
+    assert budget.estimate("out.docx", job, prefer_updated=True) > budget.estimate("out.docx", job)
+
+    record, = build.report_records([build.run_job(job, prefer_updated=True)])
+    assert record["source_bytes"] == os.path.getsize(updated_source)
+
+@pytest.mark.usefixtures("tmp_folders")
+def test_restamp_finds_documents_built_from_updated_files(build):
+    """A metadata edit restamps the fused document in UPDATED_DIR instead of sending it to a rebuild"""
+    df, _ = load_merge_data()
+    rows = prepare_rows(df.head(1))
+    row = rows[0][1]
+    shutil.copy(updated_source, os.path.join(build.updated_folder, row['Transcript']))
+    build.build_documents(rows, prefer_updated=True)
+
+    row['Date'] = "1 April 1999"
+    results, unchanged, needs_build = build.restamp_documents(rows, prefer_updated=True)
+    assert needs_build == [] and unchanged == 0
+    assert [result["status"] for result in results] == ["restamped", "restamped"]
+    fused = os.path.join(build.UPDATED_DIR, row[PREPARED_OUTPUT['Transcript']])
+    assert any("1 April 1999" in text for text in paragraph_texts(fused))
+
+    # The manifest now matches, so a build has nothing left to do
+    results, skipped, _ = build.build_documents(rows, prefer_updated=True)
+    assert results == [] and skipped == 2
+
+@pytest.mark.usefixtures("tmp_folders")
+def test_merge_leaves_documents_built_from_updated_files(tmp_path, build, merge, capsys):
+    """After build, merge and a --prefer-updated build, step 3 keeps its hands off the fused documents"""
+    merge.generated_dir = build.OUTPUT_DIR
+    merge.output_dir = build.UPDATED_DIR
+    merge.footnotes_dir = build.updated_folder
+    merge.manifest_file = build.manifest_file
+    merge.source_index_file = build.source_index_file
+    merge.ledger_path = str(tmp_path / "merge_ledger.json")
+    df, _ = load_merge_data()
+    rows = prepare_rows(df.head(1))
+    row = rows[0][1]
+    shutil.copy(updated_source, os.path.join(build.updated_folder, row['Transcript']))
+    output = row[PREPARED_OUTPUT['Transcript']]
+    fused = os.path.join(build.UPDATED_DIR, output)
+
+    # make build_docs, make merge_updated
+    build.build_documents(rows)
+    merge.main()
+    assert "Merged 1 of 1 documents" in capsys.readouterr().out
+
+    # make build_final, make merge_updated
+    build.build_documents(rows, prefer_updated=True)
+    built = file_hash(fused)
+    merge.main()
+    out = capsys.readouterr().out
+    assert "Removed orphaned merged document" not in out and "Generated document not found" not in out
+    assert "Left 1 documents built from updated footnote files" in out
+    assert os.listdir(build.UPDATED_DIR) == [output]
+    assert file_hash(fused) == built
+    assert load_json_file(merge.ledger_path) == {}
@@ -0,0 +1,36 @@
+import os
+from saa_common import load_merge_data
+from preflight import run_preflight, preflight_passed
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sources_dir = os.path.join(current_dir, "data", "transcriptions-translations")
+
+def test_workbook_passes_preflight():
+    df, _ = load_merge_data()
+    problems = run_preflight(df, sources_dir)
+    assert preflight_passed(problems)
+    assert problems["seconds"] < 1
+
+def test_preflight_finds_problems(tmp_path):
+    """Missing sources, case-insensitive filename collisions and unmapped languages are reported"""
+    df, _ = load_merge_data()
+    df = df.copy()
+    df.loc[0, 'Translate'] = "no-such-file.docx"
+    df.loc[2, 'Filename'] = str(df.loc[1, 'Filename']).upper()
+    df.loc[2, 'Language'] = df.loc[1, 'Language']
+    df.loc[3, 'Language'] = "Latin"
+    updated_dir = tmp_path / "updated"
+    updated_dir.mkdir()
+    (updated_dir / "no-such-file.docx").write_bytes(b"")
+    (updated_dir / "unused.docx").write_bytes(b"")
+
+    problems = run_preflight(df, sources_dir, str(updated_dir))
+    assert not preflight_passed(problems)
+    assert problems["missing_sources"] == [(0, 'Translate', "no-such-file.docx")]
+    assert sorted(rows for _, rows in problems["collisions"]) == [[1, 2], [1, 2]]
+    assert problems["unmapped_languages"] == [(3, "Latin")]
+    assert problems["unmatched_updates"] == ["unused.docx"]
+
+    # With updated sources preferred, a source only in the updated folder is available
+    problems = run_preflight(df, sources_dir, str(updated_dir), prefer_updated=True)
+    assert problems["missing_sources"] == []
@@ -0,0 +1,143 @@
+import os
+import json
+import shutil
+import zipfile
+import pytest
+from lxml import etree
+from docx import Document
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+generated_dir = os.path.join(current_dir, "generated_documents")
+sources_dir = os.path.join(current_dir, "data", "transcriptions-translations")
+
+W = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+
+# The 1196 letter is the longest document in the corpus
+CASES = [
+    ("565.A_1196_01_NL_transcript.docx", "565.A_1196_04-06-1672-Dut.docx", "Transcription:"),
+    ("565.A_1196_01_EN_translate.docx", "565.A_1196_04-06-1672-Eng.docx", "Translation:"),
+]
+
+def paragraph_texts(path):
+    """Return the text of every body paragraph"""
+    return [para.text for para in Document(path).paragraphs]
+
+def referenced_footnotes(path):
+    """Return the text of each footnote in the order the body references it"""
+    with zipfile.ZipFile(path) as package:
+        document = etree.fromstring(package.read("word/document.xml"))
+        footnotes = etree.fromstring(package.read("word/footnotes.xml"))
+    texts = {
+        footnote.get(f"{{{W}}}id"): "".join(footnote.itertext())
+        for footnote in footnotes.iter(f"{{{W}}}footnote")
+    }
+    return [texts[ref.get(f"{{{W}}}id")] for ref in document.iter(f"{{{W}}}footnoteReference")]
+
+def test_replace_section_round_trip(tmp_path, merge):
+    """Replacing a section with its own source reproduces the generated document"""
+    for generated, source, section_label in CASES:
+        original_path = os.path.join(generated_dir, generated)
+        target_path = str(tmp_path / generated)
+        shutil.copy(original_path, target_path)
+
+        assert merge.replace_section_with_footnotes(
+            target_path, os.path.join(sources_dir, source), section_label)
+
+        assert paragraph_texts(target_path) == paragraph_texts(original_path)
+        assert referenced_footnotes(target_path) == referenced_footnotes(original_path)
+        assert not os.path.exists(target_path + ".tmp")
+
+def test_replace_section_keeps_following_fields(tmp_path, merge):
+    """Content is replaced up to the next metadata field, which is kept after it"""
+    generated, source, section_label = CASES[0]
+    target_path = str(tmp_path / generated)
+    doc = Document(os.path.join(generated_dir, generated))
+    field = doc.add_paragraph()
+    field.add_run("Notes:").bold = True
+    doc.save(target_path)
+
+    assert merge.replace_section_with_footnotes(
+        target_path, os.path.join(sources_dir, source), section_label)
+
+    texts = paragraph_texts(target_path)
+    source_texts = paragraph_texts(os.path.join(sources_dir, source))
+    label_idx = next(i for i, text in enumerate(texts) if text.startswith(section_label))
+    assert texts[label_idx + 1:label_idx + 1 + len(source_texts)] == source_texts
+    assert texts[label_idx + 1 + len(source_texts):] == ["Notes:"]
+
+def test_replace_section_missing_label(tmp_path, merge):
+    """A target without the section label is left untouched"""
+    generated, source, _ = CASES[0]
+    target_path = str(tmp_path / generated)
+    shutil.copy(os.path.join(generated_dir, generated), target_path)
+    with open(target_path, "rb") as f:
+        before = f.read()
+
+    assert not merge.replace_section_with_footnotes(
+        target_path, os.path.join(sources_dir, source), "No Such Section:")
+
+    with open(target_path, "rb") as f:
+        assert f.read() == before
+
+def test_parallel_merge_matches_serial(tmp_path, merge):
+    """Worker processes give the same documents as a serial merge, and leave no temp files"""
+    results = {}
+    for workers in (1, 2):
+        out_dir = tmp_path / f"workers{workers}"
+        out_dir.mkdir()
+        tasks = [(os.path.join(generated_dir, generated), os.path.join(sources_dir, source), label,
+                  str(out_dir / generated)) for generated, source, label in CASES]
+        tasks.append((os.path.join(generated_dir, CASES[0][0]), os.path.join(sources_dir, "missing.docx"),
+                      CASES[0][2], str(out_dir / "broken.docx")))
+        results[workers] = merge.merge_documents(tasks, workers)
+        assert sorted(os.listdir(out_dir)) == sorted(generated for generated, _, _ in CASES)
+
+    for serial, parallel in zip(results[1], results[2]):
+        assert (serial["output"], serial["merged"]) == (parallel["output"], parallel["merged"])
+        assert (serial["error"] is None) == (parallel["error"] is None)
+    assert [result["merged"] for result in results[2]] == [True, True, False]
+    assert results[2][-1]["error"]
+    for generated, _, _ in CASES:
+        assert paragraph_texts(str(tmp_path / "workers1" / generated)) == \
+            paragraph_texts(str(tmp_path / "workers2" / generated))
+
+def test_bundle_passes_on_documents_without_the_section(tmp_path, merge):
+    """As in the file mode, a document without the section label is bundled unchanged, not failed"""
+    generated, source, label = CASES[0]
+    generated_path = os.path.join(generated_dir, generated)
+    matches = [(generated_path, os.path.join(sources_dir, source), label),
+               (os.path.join(generated_dir, CASES[1][0]), os.path.join(sources_dir, CASES[1][1]), "No Such Section:"),
+               (generated_path, os.path.join(sources_dir, "missing.docx"), label)]
+    bundle_path = str(tmp_path / "merged.zip")
+    results = merge.bundle_merged_documents(matches, bundle_path)
+    assert [(result["merged"], result["error"] is None) for result in results] == [
+        (True, True), (False, True), (False, False)]
+
+    with zipfile.ZipFile(bundle_path) as archive:
+        manifest = json.loads(archive.read("manifest.json"))
+        assert sorted(archive.namelist()) == sorted([generated, CASES[1][0], "manifest.json"])
+        with open(os.path.join(generated_dir, CASES[1][0]), "rb") as f:
+            assert archive.read(CASES[1][0]) == f.read()
+    assert manifest["failed"] == [generated]
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_bundle_adds_each_document_as_it_is_merged(tmp_path, merge, monkeypatch, workers):
+    """Merged documents go into the archive one by one instead of after the whole merge"""
+    events = []
+    class RecordingBundle(merge.DocumentBundle):
+        def add(self, path, data):
+            events.append(("add", path))
+            super().add(path, data)
+    monkeypatch.setattr(merge, "DocumentBundle", RecordingBundle)
+    merged = merge.iter_merge_documents
+    def recording_merges(tasks, workers=1):
+        for result in merged(tasks, workers):
+            events.append(("merged", result["output"]))
+            yield result
+    monkeypatch.setattr(merge, "iter_merge_documents", recording_merges)
+
+    matches = [(os.path.join(generated_dir, generated), os.path.join(sources_dir, source), label)
+               for generated, source, label in CASES]
+    results = merge.bundle_merged_documents(matches, str(tmp_path / "merged.zip"), workers)
+    assert events == [(event, generated) for generated, _, _ in CASES for event in ("merged", "add")]
+    assert all(result["data"] is None for result in results)
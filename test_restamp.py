@@ -0,0 +1,60 @@
+import shutil
+from docx import Document
+from docx.oxml.ns import qn
+from saa_common import load_merge_data
+
+def document_texts(path):
+    doc = Document(path)
+    header = [para.text for section in doc.sections
+              for table in section.header.tables for cell in table._cells for para in cell.paragraphs]
+    return header + [para.text for para in doc.paragraphs]
+
+def test_restamp_matches_rebuild(tmp_path, build):
+    """Restamping changed metadata gives the same text as building the document again"""
+    df, _ = load_merge_data()
+    row = df.iloc[0].copy()
+    build.OUTPUT_DIR = str(tmp_path)
+    original = build.create_document(row, 'Transcript')
+    restamped = str(tmp_path / "restamped.docx")
+    shutil.copy(original, restamped)
+
+    row['Date'] = "1 January 1711"
+    row['Digital ID'] = 1234.5
+    row['Transcript range'] = "7-8"
+    row['Sender Place'] = float('nan')
+    assert build.restamp_document(restamped, row, 'Transcript') == "restamped"
+    rebuilt = build.create_document(row, 'Transcript')
+
+    assert document_texts(restamped) == document_texts(rebuilt)
+    assert "Date: \t\t\t1 January 1711" in document_texts(restamped)
+
+def test_restamp_rebuilds_when_a_field_line_is_gone(tmp_path, build):
+    """A field that had no value at build time has no line left to fill, so the document is rebuilt"""
+    df, _ = load_merge_data()
+    row = df.iloc[0].copy()
+    row['Receiver'] = float('nan')
+    build.OUTPUT_DIR = str(tmp_path)
+    output = build.create_document(row, 'Transcript')
+
+    row['Receiver'] = "Someone New"
+    assert build.restamp_document(output, row, 'Transcript') == "rebuilt"
+    assert "Receiver: \t\tSomeone New" in document_texts(output)
+
+def run_count(path):
+    doc = Document(path)
+    return sum(1 for part in [doc.element.body] + [section.header._element for section in doc.sections]
+               for _ in part.iter(qn('w:r')))
+
+def test_repeated_restamps_do_not_grow_the_document(tmp_path, build):
+    """Rebuilt fields replace their runs, so every restamp leaves the same number of runs"""
+    df, _ = load_merge_data()
+    row = df.iloc[0].copy()
+    build.OUTPUT_DIR = str(tmp_path)
+    output = build.create_document(row, 'Transcript')
+    counts = []
+    for date in ("1 January 1711", "2 February 1712", "3 March 1713"):
+        row['Date'] = date
+        row['Digital ID'] = f"565.X_{date[0]}"
+        assert build.restamp_document(output, row, 'Transcript') == "restamped"
+        counts.append(run_count(output))
+    assert counts[0] == counts[1] == counts[2] == run_count(build.create_document(row, 'Transcript'))
@@ -0,0 +1,43 @@
+import os
+import sys
+import subprocess
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+def imported_after(code):
+    """Heavy modules imported by a fresh interpreter after running code"""
+    check = code + "\nimport sys; print(' '.join(m for m in ('pandas', 'docx', 'docxcompose') if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", check], cwd=current_dir, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    return result.stdout.split("\n")[-2].split()
+
+def test_help_imports_no_heavy_modules():
+    assert imported_after("import saa_build; saa_build.make_parser().format_help()") == []
+
+def test_check_does_not_import_the_document_libraries():
+    assert imported_after("import saa_build; assert saa_build.main(['check']) == 0") == ['pandas']
+
+SPAWN_CHECK = """
+import os, sys, multiprocessing
+from saa_common import load_script, process_pool
+multiprocessing.set_start_method('spawn')
+build = load_script('build_document_and_header')
+merge = load_script('merge_good_format')
+row = {'Filename': '565.A_1196_01', 'Language': 'Dutch'}
+with process_pool(2, build.__name__) as executor:
+    print(list(executor.map(build.get_output_filename, [row, row], ['Transcript', 'Translate'])))
+generated = os.path.join('generated_documents', '565.A_1196_01_NL_transcript.docx')
+source = os.path.join('data', 'transcriptions-translations', '565.A_1196_04-06-1672-Dut.docx')
+tasks = [(generated, source, 'Transcription:', os.path.join(sys.argv[1], name)) for name in ('a.docx', 'b.docx')]
+print([result['merged'] for result in merge.merge_documents(tasks, 2)])
+"""
+
+def test_step_scripts_run_in_spawned_workers(tmp_path):
+    """Workers started with spawn (the Windows default) load the step scripts imported with load_script"""
+    result = subprocess.run([sys.executable, "-c", SPAWN_CHECK, str(tmp_path)], cwd=current_dir,
+                            capture_output=True, text=True, timeout=300)
+    assert result.returncode == 0, result.stderr
+    lines = result.stdout.splitlines()
+    assert "['565.A_1196_01_NL_transcript.docx', '565.A_1196_01_EN_translate.docx']" in lines
+    assert lines[-1] == "[True, True]"
+    assert sorted(os.listdir(tmp_path)) == ["a.docx", "b.docx"]
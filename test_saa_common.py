@@ -0,0 +1,39 @@
+import pandas as pd
+from saa_common import load_merge_data, output_filename, output_filenames, get_lang_code
+from saa_common import prepare_rows, stream_workbook_rows
+
+def test_output_filenames_match_the_per_row_rules():
+    """The whole-sheet filenames equal output_filename with get_lang_code, including odd cells"""
+    df, _ = load_merge_data()
+    extra = pd.DataFrame({
+        'Filename': [float('nan'), '565.A_9001', '565.A 9002/b?', '565.A_9003'],
+        'Language': ['Dutch', float('nan'), 'Latin', 'GERMAN/DUTCH'],
+    })
+    df = pd.concat([df, extra], ignore_index=True)
+
+    outputs = output_filenames(df)
+    for content_type in ('Transcript', 'Translate'):
+        expected = [output_filename(str(filename), get_lang_code(language, content_type), content_type)
+                    for filename, language in zip(df['Filename'], df['Language'])]
+        assert list(outputs[content_type]) == expected
+    assert list(outputs['Transcript'][-4:]) == [
+        'nan_NL_transcript.docx', '565.A_9001_nan_transcript.docx',
+        '565.A_9002b_Latin_transcript.docx', '565.A_9003_DE-NL_transcript.docx',
+    ]
+
+def test_streamed_rows_match_prepared_rows(build):
+    """The streaming reader gives the build the same rows, filenames, citations and manifest values"""
+    df, _ = load_merge_data()
+    prepared = prepare_rows(df)
+    streamed = list(stream_workbook_rows())
+    assert [idx for idx, _ in streamed] == [idx for idx, _ in prepared]
+
+    for (_, record), (_, row) in zip(prepared, streamed):
+        assert [str(row.get(column, '')) for column in build.ROW_COLUMNS] == \
+            [str(record.get(column, '')) for column in build.ROW_COLUMNS]
+        for content_type in ('Transcript', 'Translate'):
+            assert pd.isna(row.get(content_type)) == pd.isna(record.get(content_type))
+            if pd.isna(record.get(content_type)):
+                continue
+            assert build.get_output_filename(row, content_type) == build.get_output_filename(record, content_type)
+            assert build.format_citation_text(row, content_type) == build.format_citation_text(record, content_type)
@@ -0,0 +1,60 @@
+import os
+import shutil
+from source_cache import SourceCache
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sources_dir = os.path.join(current_dir, "data", "transcriptions-translations")
+SOURCES = ["565.A_1196_04-06-1672-Dut.docx", "565.A_1196_04-06-1672-Eng.docx", "565.A_1249_01-04-1672-Ger.docx"]
+
+def copy_sources(tmp_path):
+    paths = []
+    for name in SOURCES:
+        path = str(tmp_path / name)
+        shutil.copy(os.path.join(sources_dir, name), path)
+        paths.append(path)
+    return paths
+
+def test_touched_file_keeps_its_parse_and_changed_file_is_reparsed(tmp_path):
+    """Lookups revalidate by mtime and size, and re-parse only when the content hash changed"""
+    first, second, _ = copy_sources(tmp_path)
+    cache = SourceCache(max_bytes=1 << 30)
+    document = cache.get(first)
+    assert cache.get(first) is document
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # Same content with a new mtime: revalidated by hash, no new parse
+    stat = os.stat(first)
+    os.utime(first, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert cache.get(first) is document
+    assert (cache.hits, cache.misses) == (2, 1)
+
+    # New content: parsed again, and the cache weight follows the new package
+    shutil.copy(second, first)
+    reparsed = cache.get(first)
+    assert reparsed is not document
+    assert cache.misses == 2
+    assert len(cache) == 1
+    assert cache.total_bytes == next(iter(cache._entries.values()))["weight"]
+
+def test_least_recently_used_documents_are_evicted(tmp_path):
+    """Entries are evicted least recently used first once their package sizes exceed the bound"""
+    paths = copy_sources(tmp_path)
+    probe = SourceCache(max_bytes=1 << 30)
+    for path in paths:
+        probe.get(path)
+    weights = [entry["weight"] for entry in probe._entries.values()]
+
+    # One byte short of room for all three
+    cache = SourceCache(max_bytes=sum(weights) - 1)
+    cache.get(paths[0])
+    cache.get(paths[1])
+    cache.get(paths[0])  # paths[1] is now the least recently used
+    cache.get(paths[2])
+    assert list(cache._entries) == [paths[0], paths[2]]
+    assert cache.total_bytes == weights[0] + weights[2]
+
+    # A document larger than the whole bound is still kept while it is the most recent
+    tiny = SourceCache(max_bytes=1)
+    tiny.get(paths[0])
+    tiny.get(paths[1])
+    assert list(tiny._entries) == [paths[1]]
@@ -0,0 +1,65 @@
+import os
+import shutil
+import zipfile
+import pytest
+from docx import Document
+from saa_common import load_merge_data, prepare_rows, PREPARED_OUTPUT
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+generated_file = os.path.join(current_dir, "generated_documents", "565.A_1196_01_NL_transcript.docx")
+sources_dir = os.path.join(current_dir, "data", "transcriptions-translations")
+
+def header_texts(path):
+    doc = Document(path)
+    return [para.text for section in doc.sections
+            for table in section.header.tables for cell in table._cells for para in cell.paragraphs]
+
+def test_stamp_digital_id_matches_full_update(tmp_path, build):
+    """Patching the header part gives the same package content as a python-docx load and save"""
+    stamped = str(tmp_path / "stamped.docx")
+    reference = str(tmp_path / "reference.docx")
+    shutil.copy(generated_file, stamped)
+
+    doc = Document(generated_file)
+    for section in doc.sections:
+        build.update_digital_id_in_header(section.header, "565.X_0001")
+    doc.save(reference)
+
+    assert build.stamp_digital_id(stamped, "565.X_0001")
+    assert "Digital ID: 565.X_0001" in header_texts(stamped)
+
+    with zipfile.ZipFile(stamped) as patched, zipfile.ZipFile(reference) as full, \
+            zipfile.ZipFile(generated_file) as original:
+        assert patched.testzip() is None
+        assert patched.namelist() == original.namelist()
+        for name in patched.namelist():
+            assert patched.read(name) == full.read(name)
+            # Members other than the header keep their compressed bytes
+            if not name.startswith("word/header"):
+                before, after = original.getinfo(name), patched.getinfo(name)
+                assert (after.CRC, after.compress_size) == (before.CRC, before.compress_size)
+
+    # Stamping the same ID again leaves the file alone
+    assert not build.stamp_digital_id(stamped, "565.X_0001")
+
+@pytest.mark.usefixtures("tmp_folders")
+@pytest.mark.parametrize("prefer_updated", [False, True])
+def test_stamped_documents_are_not_rebuilt(build, capsys, prefer_updated):
+    """--stamp-ids finds fused documents too, and records the new ID so the next build skips them"""
+    df, _ = load_merge_data()
+    rows = prepare_rows(df.head(1))
+    row = rows[0][1]
+    if prefer_updated:
+        shutil.copy(os.path.join(sources_dir, row['Transcript']), build.updated_folder)
+    build.build_documents(rows, prefer_updated=prefer_updated)
+
+    row['Digital ID'] = "565.X_0001"
+    build.stamp_digital_ids(rows)
+    assert "Stamped 2 documents" in capsys.readouterr().out
+    fused = os.path.join(build.UPDATED_DIR, row[PREPARED_OUTPUT['Transcript']])
+    assert os.path.exists(fused) == prefer_updated
+    if prefer_updated:
+        assert "Digital ID: 565.X_0001" in header_texts(fused)
+
+    results, skipped, _ = build.build_documents(rows, prefer_updated=prefer_updated)
+    assert results == [] and skipped == 2
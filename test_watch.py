@@ -0,0 +1,19 @@
+from watch import snapshot, changed_paths
+
+def test_snapshot_reports_added_changed_and_removed_files(tmp_path):
+    workbook = tmp_path / "book.xlsx"
+    workbook.write_bytes(b"v1")
+    sources = tmp_path / "sources"
+    sources.mkdir()
+    (sources / "a.docx").write_bytes(b"a")
+    (sources / "~$a.docx").write_bytes(b"lock")
+    (sources / "notes.txt").write_bytes(b"ignored")
+    before = snapshot([str(workbook)], [str(sources)])
+    assert set(before) == {str(workbook), str(sources / "a.docx")}
+
+    workbook.write_bytes(b"version 2")
+    (sources / "a.docx").unlink()
+    (sources / "b.docx").write_bytes(b"b")
+    after = snapshot([str(workbook)], [str(sources)])
+    assert changed_paths(before, after) == sorted([str(workbook), str(sources / "a.docx"), str(sources / "b.docx")])
+    assert changed_paths(after, snapshot([str(workbook)], [str(sources)])) == []
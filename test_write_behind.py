@@ -0,0 +1,33 @@
+import os
+from write_behind import WriteBehind
+
+def test_writes_in_order_and_reports_errors(tmp_path):
+    """The last write to a path wins, failures are returned by path and no temp files are left"""
+    writer = WriteBehind(max_pending=1)
+    target = str(tmp_path / "out.docx")
+    for n in range(5):
+        writer.submit(target, f"version {n}".encode())
+    bad = str(tmp_path / "missing" / "out.docx")
+    writer.submit(bad, b"data")
+    errors = writer.close()
+
+    with open(target, 'rb') as f:
+        assert f.read() == b"version 4"
+    assert list(errors) == [bad]
+    assert writer.written == 5
+    assert os.listdir(tmp_path) == ["out.docx"]
+
+def test_unexpected_write_error_does_not_stop_the_writer():
+    """An exception of any type is recorded and later writes still go through"""
+    written = []
+    def write(path, data):
+        if path == "bad":
+            raise RuntimeError("archive is broken")
+        written.append(path)
+    writer = WriteBehind(max_pending=1, write=write)
+    for path in ["a", "bad", "b", "c", "d"]:
+        writer.submit(path, b"data")
+    errors = writer.close()
+
+    assert written == ["a", "b", "c", "d"]
+    assert errors == {"bad": "Error writing bad: archive is broken"}
@@ -0,0 +1,139 @@
+import os
+import time
+import argparse
+from saa_common import excel_file, load_merge_data, prepare_rows, load_script, LOG_LEVELS, log, set_log_level
+from preflight import run_preflight, preflight_passed, print_preflight
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Seconds between polls of the watched files
+POLL_INTERVAL = 0.5
+
+def snapshot(paths, folders):
+    """(mtime, size) of each watched file and of every .docx in the watched folders"""
+    state = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            state[path] = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            state[path] = None
+    for folder in folders:
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    # Skip Word's ~$ lock files
+                    if entry.name.lower().endswith('.docx') and not entry.name.startswith('~$'):
+                        stat = entry.stat()
+                        state[entry.path] = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            pass
+    return state
+
+def changed_paths(before, after):
+    """Paths added, removed or modified between two snapshots"""
+    return sorted(path for path in before.keys() | after.keys() if before.get(path) != after.get(path))
+
+class Watcher:
+    """
+    Keeps the build module, the workbook rows, the cleaned template and the
+    parsed sources in memory between rebuilds. Each update restamps the
+    documents whose metadata columns changed and rebuilds the ones whose other
+    inputs changed, both through the build manifest, so only the outputs that
+    depend on a changed row or file are touched.
+    """
+    def __init__(self, build, prefer_updated=False):
+        self.build = build
+        self.prefer_updated = prefer_updated
+        self.df = None
+        self.rows = None
+        self.paths = [excel_file, build.template_file]
+        self.folders = [os.path.join(build.data_folder, 'transcriptions-translations')]
+        if prefer_updated:
+            self.folders.append(build.updated_folder)
+
+    def snapshot(self):
+        return snapshot(self.paths, self.folders)
+
+    def update(self, changed):
+        """Bring the outputs up to date after the given paths changed"""
+        start = time.perf_counter()
+        build = self.build
+        workbook_changed = self.rows is None or excel_file in changed
+        if workbook_changed:
+            try:
+                self.df, _ = load_merge_data()
+            except Exception as e:
+                # Most likely saved halfway; the next change will retry
+                print(f"Error loading {excel_file}: {e}")
+                return
+            self.rows = prepare_rows(self.df)
+        if build.template_file in changed:
+            build._template_cache.clear()
+
+        problems = run_preflight(self.df, self.folders[0], build.updated_folder, self.prefer_updated)
+        if not preflight_passed(problems):
+            print_preflight(problems)
+            print("Not rebuilding until the problems are fixed")
+            return
+
+        restamped = []
+        if workbook_changed:
+            results, _, _ = build.restamp_documents(self.rows, prefer_updated=self.prefer_updated)
+            restamped = [result for result in results if not result["error"]]
+        results, skipped, _ = build.build_documents(self.rows, prefer_updated=self.prefer_updated)
+
+        for result in results:
+            if result["error"]:
+                print(f"Error building row {result['row']} ({result['content_type']}):")
+                print(result["error"])
+            elif result["path"]:
+                log(f"Rebuilt {os.path.basename(result['path'])}", 'debug')
+        built = sum(1 for result in results if result["path"] and not result["error"])
+        # Restamped documents are up to date by the time of the build, which skips them
+        print(f"Rebuilt {built}, restamped {len(restamped)}, {skipped - len(restamped)} unchanged "
+              f"({time.perf_counter() - start:.2f}s)")
+
+def watch(interval=POLL_INTERVAL, prefer_updated=False):
+    """Build once, then rebuild the affected documents whenever a watched file changes"""
+    build = load_script('build_document_and_header')
+    watcher = Watcher(build, prefer_updated)
+    state = watcher.snapshot()
+    watcher.update(set(state))
+    print(f"Watching {excel_file}, the template and {len(state) - len(watcher.paths)} source files "
+          f"(Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(interval)
+            current = watcher.snapshot()
+            if current == state:
+                continue
+            # Wait for the writes to settle; editors and sync clients save in several steps
+            while True:
+                time.sleep(interval)
+                settled = watcher.snapshot()
+                if settled == current:
+                    break
+                current = settled
+            changed = changed_paths(state, current)
+            state = current
+            for path in changed:
+                print(f"Changed: {os.path.relpath(path, current_dir)}")
+            watcher.update(set(changed))
+    except KeyboardInterrupt:
+        print("Stopped watching")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Keep the generated documents up to date while the workbook, template and sources change")
+    parser.add_argument("--interval", type=float, default=POLL_INTERVAL,
+                        help=f"Seconds between checks for changes (default: {POLL_INTERVAL})")
+    parser.add_argument("--prefer-updated", action="store_true",
+                        help="Build from the DBL-UpdatedFootnotes version of a source where there is one "
+                             "(see 02_build_document_and_header.py) and watch that folder too")
+    parser.add_argument("--log-level", choices=list(LOG_LEVELS), default=None,
+                        help="Console verbosity; 'debug' lists every document rebuilt (default: info)")
+    args = parser.parse_args()
+    if args.log_level:
+        set_log_level(args.log_level)
+    watch(interval=args.interval, prefer_updated=args.prefer_updated)
@@ -0,0 +1,69 @@
+import os
+import time
+import queue
+import threading
+
+# Default number of serialized documents that may wait for the writer
+WRITE_QUEUE_DEPTH = 8
+
+def atomic_write_bytes(path, data):
+    """Write data to path through a temporary file and a rename, so readers never see a partial file"""
+    temp_path = path + ".tmp"
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except OSError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+class WriteBehind:
+    """
+    Background writer thread for serialized documents. submit() hands over the
+    bytes and returns at once, so the next document can be composed while the
+    previous one is written. At most max_pending documents wait in the queue;
+    submit() blocks when it is full, which bounds the memory held.
+
+    Writes for the same path happen in submission order. A failed write does
+    not stop the others; close() waits for the queue to drain and returns the
+    errors by path. write(path, data) does the writing, atomic_write_bytes by
+    default (DocumentBundle.add to stream into an archive instead).
+    """
+    def __init__(self, max_pending=WRITE_QUEUE_DEPTH, write=atomic_write_bytes):
+        self._queue = queue.Queue(maxsize=max(1, max_pending))
+        self._write = write
+        self.errors = {}
+        self.written = 0
+        self.bytes_written = 0
+        self.write_seconds = 0.0
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def submit(self, path, data):
+        """Queue data to be written to path, waiting if the queue is full"""
+        self._queue.put((path, data))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            path, data = item
+            start = time.perf_counter()
+            try:
+                self._write(path, data)
+                self.errors.pop(path, None)
+                self.written += 1
+                self.bytes_written += len(data)
+            except Exception as e:
+                # Any failure is recorded: a dead writer thread would leave submit() blocked
+                self.errors[path] = f"Error writing {path}: {e}"
+            self.write_seconds += time.perf_counter() - start
+
+    def close(self):
+        """Write everything still queued, stop the thread and return {path: error}"""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        return self.errors